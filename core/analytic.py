@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Fixed-point analytic model of the simulator with ALGORITHM_CONTIKI.
+#
+# Each gateway's queue is approximated by a birth-death chain over the queue
+# length 0..MAX_QUEUE, with the arrival probability per slot given by the
+# traffic, and the departure probability per slot given by:
+#  * the dedicated cells of the gateway;
+#  * the shared slots, in which a gateway with Q packets transmits with the
+#    probability min(1, Q / numSharedSlots), like in getPacketsContiki;
+#  * the probability that an attempt fails, because of the link or because of
+#    a collision with the other gateways (or, with DO_CCA, a CCA failure),
+#    which determines how many attempts a packet needs before it leaves the queue.
+# The transmit probability of each gateway depends on the queue distributions
+# of the others, so the model is solved by fixed-point iteration.
+#
+# Predicting a configuration takes milliseconds. The model is an approximation
+# (e.g. the arrivals are treated as random, not periodic), so each prediction can
+# be checked against the simulator with `Prediction.validate()`.
+#
+# Usage:
+#
+#    p = analytic.predict([14] * 4, prrlist, 0.7, 80, 16)
+#    print(p.pdr, p.collisionsRx)
+#    print(p.validate(repeat = 5))
+#
+#    # the most promising numbers of shared slots, to simulate first
+#    candidates = [s for s, p in analytic.screen([14] * 4, prrlist, 0.7, 80, top = 5)]
+#
+
+import math, time
+
+import sim
+
+MAX_ITERATIONS = 500
+TOLERANCE = 1e-10
+DAMPING = 0.5
+
+######################################
+
+#
+# Probability distribution of the number of successes in independent
+# Bernoulli trials with the given probabilities.
+#
+def poissonBinomial(probs):
+    dist = [1.0]
+    for p in probs:
+        new = [0.0] * (len(dist) + 1)
+        for k in range(len(dist)):
+            new[k] += dist[k] * (1.0 - p)
+            new[k + 1] += dist[k] * p
+        dist = new
+    return dist
+
+#
+# The numbers of dedicated slots per gateway and shared slots in the slotframe,
+# like in `sim.simulateAny`.
+#
+def slotAllocation(numGws, totalSlots, sharedSlots):
+    if sharedSlots == 0:
+        return totalSlots // numGws, 0
+    if sharedSlots >= totalSlots or (totalSlots - sharedSlots) // numGws == 0:
+        return 0, sharedSlots
+    return (totalSlots - sharedSlots) // numGws, sharedSlots
+
+######################################
+
+class Prediction:
+    def __init__(self, packetsPerGw, prrlist, ccaSuccessProb, totalSlots, sharedSlots):
+        self.packetsPerGw = packetsPerGw
+        self.prrlist = prrlist
+        self.ccaSuccessProb = ccaSuccessProb
+        self.totalSlots = totalSlots
+        self.sharedSlots = sharedSlots
+        self.gwPdr = []
+        self.pdr = None
+        # expected Statistics counters for NUM_SLOTFRAMES slotframes
+        self.stats = sim.Statistics(packetsPerGw)
+        self.collisionsTx = 0
+        self.collisionsRx = 0
+        self.iterations = 0
+        self.converged = False
+        self.time = 0.0
+        self.validation = None
+
+    def energy(self):
+        return self.stats.energy()
+
+    #
+    # Simulates the configuration `repeat` times with the current settings of sim.py
+    # and compares the results with the prediction. The report is also stored as
+    # `self.validation`.
+    #
+    def validate(self, repeat = 5, algorithm = sim.ALGORITHM_CONTIKI):
+        start = time.time()
+        pdrs = []
+        colTx = []
+        colRx = []
+        energies = []
+        for r in range(repeat):
+            stats = sim.Statistics(self.packetsPerGw)
+            sim.simulateAny(stats, self.packetsPerGw, self.prrlist, self.ccaSuccessProb, algorithm,
+                            self.totalSlots, self.sharedSlots)
+            pdrs.append(stats.pdr)
+            colTx.append(stats.collisionsTx)
+            colRx.append(stats.collisionsRx)
+            energies.append(stats.energy())
+        pdrMean, pdrStd = sim.std(pdrs)
+        self.validation = {
+            "repeat": repeat,
+            "simulatedPdr": pdrMean,
+            "simulatedPdrStderr": pdrStd / math.sqrt(repeat - 1) if repeat > 1 else None,
+            "predictedPdr": self.pdr,
+            "pdrError": self.pdr - pdrMean,
+            "simulatedCollisionsTx": sim.mean(colTx),
+            "predictedCollisionsTx": self.collisionsTx,
+            "simulatedCollisionsRx": sim.mean(colRx),
+            "predictedCollisionsRx": self.collisionsRx,
+            "simulatedEnergy": sim.mean(energies),
+            "predictedEnergy": self.energy(),
+            "simulationTime": time.time() - start,
+            "predictionTime": self.time,
+        }
+        return self.validation
+
+    def __repr__(self):
+        return "PDR {:.4f}, collisions Tx {:.1f} Rx {:.1f}, energy {:.4f} J ({} iterations)".format(
+            self.pdr, self.collisionsTx, self.collisionsRx, self.energy(), self.iterations)
+
+######################################
+
+#
+# Stationary distribution of a birth-death chain with the arrival probability `a`
+# per slot and the departure probabilities `mu[q]` from queue length q.
+#
+def queueDistribution(a, mu, maxQueue):
+    pi = [1.0] * (maxQueue + 1)
+    for q in range(1, maxQueue + 1):
+        if mu[q] <= 0.0:
+            pi[q] = float("inf") if pi[q - 1] > 0 and a > 0 else 0.0
+        else:
+            pi[q] = pi[q - 1] * a / mu[q]
+    if any(math.isinf(x) for x in pi):
+        # no service at all: the queue is always full
+        return [0.0] * maxQueue + [1.0] if a > 0 else [1.0] + [0.0] * maxQueue
+    total = sum(pi)
+    return [x / total for x in pi]
+
+#
+# Predicts the PDR and the collision counts of `sim.simulateAny` with ALGORITHM_CONTIKI,
+# using the current settings of sim.py (DO_CCA, NUM_TX, MAX_QUEUE, SLOTFRAME_SIZE, NUM_SLOTFRAMES).
+# If `validateRepeat` is positive, the prediction is also validated with that many simulations.
+#
+def predict(packetsPerGw, prrlist, ccaSuccessProb, totalSlots, sharedSlots, validateRepeat = 0):
+    start = time.time()
+    n = len(packetsPerGw)
+    dedicated, shared = slotAllocation(n, totalSlots, sharedSlots)
+    frame = float(sim.SLOTFRAME_SIZE)
+    K = sim.MAX_QUEUE
+    prediction = Prediction(packetsPerGw, prrlist, ccaSuccessProb, totalSlots, sharedSlots)
+
+    arrival = [min(1.0, packetsPerGw[i] / frame) for i in range(n)]
+    dedicatedRate = dedicated / frame
+    sharedRate = shared / frame
+    # transmit probability of a gateway with q packets in a shared slot
+    transmit = [min(1.0, q / float(shared)) if shared else 0.0 for q in range(K + 1)]
+
+    tau = [0.0] * n
+    pis = [[1.0] + [0.0] * K for i in range(n)]
+    fail = [0.0] * n
+    for iteration in range(MAX_ITERATIONS):
+        newTau = [0.0] * n
+        for i in range(n):
+            p = prrlist[i]
+            # number of other gateways transmitting in a shared slot
+            others = poissonBinomial([tau[j] for j in range(n) if j != i])
+            if sim.DO_CCA:
+                # with k others, the CCA succeeds with probability cca^k; then one of the
+                # k + 1 packets is sent and the rest back off without using an attempt
+                consumed = others[0]
+                success = others[0]
+                for k in range(1, len(others)):
+                    g = ccaSuccessProb ** k
+                    consumed += others[k] * (g / (k + 1) + (1.0 - g))
+                    success += others[k] * g / (k + 1)
+                success *= p
+            else:
+                consumed = 1.0
+                success = others[0] * p
+
+            # attempt rates per slot for a non-empty queue, averaged over the queue length
+            busy = 1.0 - pis[i][0]
+            meanTransmit = sum(pis[i][q] * transmit[q] for q in range(1, K + 1)) / busy if busy > 0 else transmit[1]
+            sharedAttempts = sharedRate * meanTransmit * consumed
+            attempts = dedicatedRate + sharedAttempts
+            if attempts > 0:
+                f = 1.0 - (dedicatedRate * p + sharedRate * meanTransmit * success) / attempts
+            else:
+                f = 1.0
+            fail[i] = f
+            # expected attempts per packet, and so the probability of leaving the queue per attempt
+            perPacket = (1.0 - f ** sim.NUM_TX) / (1.0 - f) if f < 1.0 else sim.NUM_TX
+            mu = [0.0] + [(dedicatedRate + sharedRate * transmit[q] * consumed) / perPacket
+                          for q in range(1, K + 1)]
+            pis[i] = queueDistribution(arrival[i], mu, K)
+            newTau[i] = sum(pis[i][q] * transmit[q] for q in range(K + 1))
+
+        change = max([abs(newTau[i] - tau[i]) for i in range(n)] + [0.0])
+        tau = [DAMPING * tau[i] + (1.0 - DAMPING) * newTau[i] for i in range(n)]
+        prediction.iterations = iteration + 1
+        if change < TOLERANCE:
+            prediction.converged = True
+            break
+
+    # delivery: not blocked on arrival, and not failing NUM_TX times
+    for i in range(n):
+        blocked = pis[i][K]
+        prediction.gwPdr.append(100.0 * (1.0 - blocked) * (1.0 - fail[i] ** sim.NUM_TX))
+    prediction.pdr = sum(prediction.gwPdr) / n
+
+    # expected counters per slotframe
+    alone = [tau[i] * poissonBinomial([tau[j] for j in range(n) if j != i])[0] for i in range(n)]
+    nobody = 1.0
+    for t in tau:
+        nobody *= 1.0 - t
+    several = max(0.0, 1.0 - nobody - sum(alone))
+    stats = prediction.stats
+    frames = sim.NUM_SLOTFRAMES
+    busyDedicated = sum(dedicated * (1.0 - pis[i][0]) for i in range(n))
+    stats.txrx = frames * (busyDedicated + shared * sum(alone))
+    stats.idlelistening = frames * (n * dedicated - busyDedicated + shared * nobody)
+    stats.sleeping = frames * (frame - n * dedicated - shared)
+    if not sim.DO_CCA:
+        # collisions are not counted in the simulator when CCA is used
+        stats.collisionsRx = frames * shared * several
+        stats.collisionsTx = frames * shared * (sum(tau) - sum(alone))
+    stats.pdr = prediction.pdr
+    prediction.collisionsTx = stats.collisionsTx
+    prediction.collisionsRx = stats.collisionsRx
+    prediction.time = time.time() - start
+
+    if validateRepeat > 0:
+        prediction.validate(validateRepeat)
+    return prediction
+
+#
+# Predicts each number of shared slots in `candidates` (by default 0 to `totalSlots`) and returns
+# (sharedSlots, prediction) pairs, the best predicted PDR first. With `top`, only that many are returned.
+#
+def screen(packetsPerGw, prrlist, ccaSuccessProb, totalSlots, candidates = None, top = None):
+    if candidates is None:
+        candidates = list(range(totalSlots + 1))
+        if totalSlots < len(packetsPerGw):
+            candidates.remove(0)
+    results = [(s, predict(packetsPerGw, prrlist, ccaSuccessProb, totalSlots, s)) for s in candidates]
+    results.sort(key = lambda r: -r[1].pdr)
+    return results[:top] if top is not None else results
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Batch-means execution of a single long simulation run.
+#
+# The NUM_SLOTFRAMES slotframes of one logical run are split into independent
+# batches, which are simulated in parallel in worker processes. Each batch
+# starts with its own NUM_WARMUP_SLOTFRAMES warm-up, whose results are discarded,
+# and uses its own random seed. The batch results are merged into estimates of
+# the PDR and the energy with confidence intervals from the variation between
+# the batches.
+#
+# Usage:
+#
+#    sim.NUM_SLOTFRAMES = 100000
+#    r = batch.simulateBatchMeans("simulatePartial",
+#                                 [packetsPerGw, prrlist, 0.7, sim.ALGORITHM_CONTIKI, 80, 16])
+#    print(r.pdr, "+-", r.pdrHalfWidth)
+#
+
+import random
+
+import sim, jobs, histogram
+
+# Two-sided 95% quantiles of the Student's t distribution for 1..30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+def tQuantile(df):
+    if df < 1:
+        return float("inf")
+    if df <= len(T_95):
+        return T_95[df - 1]
+    return 1.96
+
+#
+# Mean and the half-width of its 95% confidence interval.
+#
+def confidenceInterval(values):
+    m, sd = sim.std(values)
+    n = len(values)
+    if n < 2:
+        return m, float("inf")
+    # sim.std is the population deviation; convert to the sample deviation
+    sd *= (n / float(n - 1)) ** 0.5
+    return m, tQuantile(n - 1) * sd / n ** 0.5
+
+######################################
+
+class BatchResult:
+    def __init__(self, batches, packetsPerGw):
+        self.batches = batches
+        self.numSlotframes = sum(b["numSlotframes"] for b in batches)
+        # the counters of all batches together
+        self.stats = sim.Statistics(packetsPerGw)
+        for name in ["sleeping", "idlelistening", "txrx", "collisionsTx", "collisionsRx"]:
+            setattr(self.stats, name, sum(b[name] for b in batches))
+        self.pdr, self.pdrHalfWidth = confidenceInterval([b["pdr"] for b in batches])
+        self.stats.pdr = self.pdr
+        # the per-packet histograms of all batches merged
+        for b in batches:
+            if "histograms" in b:
+                h = histogram.PacketHistograms.fromDict(b["histograms"])
+                if self.stats.histograms is None:
+                    self.stats.histograms = h
+                else:
+                    self.stats.histograms.merge(h)
+        # the energy of the whole run is the sum of the batch energies; the batches may
+        # differ by a slotframe, so the interval is of the energy per slotframe
+        energy, halfWidth = confidenceInterval([b["energy"] / b["numSlotframes"] for b in batches])
+        self.energy = sum(b["energy"] for b in batches)
+        self.energyHalfWidth = halfWidth * self.numSlotframes
+        enefs = [b["enef"] for b in batches if b["enef"] is not None]
+        if enefs:
+            self.enef, self.enefHalfWidth = confidenceInterval(enefs)
+        else:
+            self.enef, self.enefHalfWidth = None, None
+
+    def __repr__(self):
+        return "PDR {:.4f} +- {:.4f}, energy {:.4f} +- {:.4f} J ({} batches)".format(
+            self.pdr, self.pdrHalfWidth, self.energy, self.energyHalfWidth, len(self.batches))
+
+#
+# Simulates `sim.<function>(stats, *args)` for NUM_SLOTFRAMES slotframes in total, split into
+# `numBatches` batches run on `processes` worker processes (all CPUs by default); the first
+# NUM_SLOTFRAMES % numBatches batches are a slotframe longer than the rest. Each batch
+# is preceded by `warmupSlotframes` discarded slotframes. The seeds of the batches are derived
+# from `seed`. With `histograms`, the merged per-packet histograms are in `stats.histograms`.
+#
+def simulateBatchMeans(function, args, numBatches = 10, warmupSlotframes = 10, processes = None,
+                       seed = None, progress = None, histograms = False):
+    if sim.NUM_SLOTFRAMES < numBatches:
+        raise ValueError("{} slotframes cannot be split into {} batches".format(sim.NUM_SLOTFRAMES, numBatches))
+    rng = random.Random(seed)
+    jobList = []
+    for i in range(numBatches):
+        job = jobs.makeJob(function, args, seed = rng.getrandbits(64), id = i, histograms = histograms)
+        job["config"]["NUM_SLOTFRAMES"] = sim.NUM_SLOTFRAMES // numBatches + (i < sim.NUM_SLOTFRAMES % numBatches)
+        job["config"]["NUM_WARMUP_SLOTFRAMES"] = warmupSlotframes
+        jobList.append(job)
+
+    batches = [None] * numBatches
+    for result in jobs.runJobs(jobList, processes, progress):
+        if "error" in result:
+            raise RuntimeError("batch {} failed: {}".format(result["id"], result["error"]))
+        batches[result["id"]] = result
+    return BatchResult(batches, args[0])
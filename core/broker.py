@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# A job queue in an SQLite database, for sweeps distributed over several machines.
+#
+# A coordinator submits jobs (see jobs.py) to the database, and worker processes
+# on any host that can open it take jobs, run them and write back the results:
+#
+#    ./broker.py worker sweep.db [processes]     # on each host
+#    ./broker.py status sweep.db
+#    ./broker.py check                           # self-check on this host
+#
+#    for result in broker.runJobs("sweep.db", jobList):   # in the experiment
+#        ...
+#
+# A worker holds a lease on its job, which it renews while the job runs. If the
+# worker is lost, the lease expires and the job is given to another worker. A job
+# is tried at most `maxAttempts` times, after a failure or a lost worker; then its
+# result is the last error.
+#
+# For workers on several hosts, the database must be on a shared file system with
+# working file locks. With all workers on one host, any local file will do.
+#
+
+import sys, os, json, time, socket, sqlite3, threading, uuid
+
+import sim
+import jobs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    sweep TEXT NOT NULL,
+    job TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    submitted REAL,
+    finished REAL,
+    seq INTEGER,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id);
+CREATE INDEX IF NOT EXISTS jobs_done ON jobs (sweep, seq);
+"""
+
+# How long a worker holds a job without renewing the lease, in seconds
+LEASE = 60.0
+
+MAX_ATTEMPTS = 3
+
+######################################
+
+def workerName():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+class Broker:
+    def __init__(self, filename, lease = LEASE, maxAttempts = MAX_ATTEMPTS):
+        self.filename = filename
+        self.lease = lease
+        self.maxAttempts = maxAttempts
+        # transactions are started explicitly, see `transaction()`
+        self.db = sqlite3.connect(filename, timeout = 60, isolation_level = None)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    #
+    # Runs `function(cursor)` in a transaction that holds the write lock from the start.
+    #
+    def transaction(self, function):
+        cursor = self.db.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            value = function(cursor)
+        except:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+        return value
+
+    #
+    # Adds the jobs to the queue and returns the name of the sweep.
+    #
+    def submit(self, jobList, sweep = None):
+        if sweep is None:
+            sweep = uuid.uuid4().hex
+        now = time.time()
+        rows = [(sweep, json.dumps(job), now) for job in jobList]
+        self.transaction(lambda c: c.executemany(
+            "INSERT INTO jobs (sweep, job, submitted) VALUES (?, ?, ?)", rows))
+        return sweep
+
+    #
+    # Marks a job as finished with `result`; the results of a sweep are numbered
+    # in the order in which they are finished.
+    #
+    def finish(self, cursor, id, state, result):
+        seq = cursor.execute("SELECT COALESCE(MAX(seq), 0) + 1 FROM jobs").fetchone()[0]
+        cursor.execute("UPDATE jobs SET state = ?, result = ?, finished = ?, seq = ?, lease_until = NULL "
+                       "WHERE id = ?", (state, json.dumps(result), time.time(), seq, id))
+
+    #
+    # Takes the next job for `worker`: a pending one, or one whose worker was lost.
+    # Returns (id, job), or None if there is nothing to do.
+    #
+    def claim(self, worker):
+        def claimJob(c):
+            now = time.time()
+            # give up on the jobs that were lost too many times
+            for id, job in c.execute("SELECT id, job FROM jobs WHERE state = 'running' AND lease_until < ? "
+                                     "AND attempts >= ?", (now, self.maxAttempts)).fetchall():
+                self.finish(c, id, "failed", {"id": json.loads(job).get("id"),
+                                              "error": "worker lost {} times".format(self.maxAttempts)})
+            row = c.execute("SELECT id, job FROM jobs WHERE state = 'pending' "
+                            "OR (state = 'running' AND lease_until < ?) ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None:
+                return None
+            c.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, attempts = attempts + 1 "
+                      "WHERE id = ?", (worker, now + self.lease, row[0]))
+            return row[0], json.loads(row[1])
+        return self.transaction(claimJob)
+
+    #
+    # Extends the lease of a job; returns False if the job is no longer held by the worker.
+    #
+    def renew(self, id, worker):
+        c = self.db.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND state = 'running'",
+                            (time.time() + self.lease, id, worker))
+        return c.rowcount > 0
+
+    #
+    # Stores the result of a job. A failed job is tried again, up to `maxAttempts` times.
+    # The result of a worker that lost its lease meanwhile is ignored.
+    #
+    def complete(self, id, worker, result):
+        def completeJob(c):
+            row = c.execute("SELECT attempts FROM jobs WHERE id = ? AND worker = ? AND state = 'running'",
+                            (id, worker)).fetchone()
+            if row is None:
+                return False
+            if "error" not in result:
+                self.finish(c, id, "done", result)
+            elif row[0] < self.maxAttempts:
+                c.execute("UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL WHERE id = ?", (id,))
+            else:
+                self.finish(c, id, "failed", result)
+            return True
+        return self.transaction(completeJob)
+
+    #
+    # The finished results of a sweep after the result number `seq`, as a list of (seq, result).
+    #
+    def results(self, sweep, seq = 0):
+        return [(s, json.loads(result)) for s, result in self.db.execute(
+            "SELECT seq, result FROM jobs WHERE sweep = ? AND seq > ? ORDER BY seq", (sweep, seq))]
+
+    #
+    # The number of jobs in each state, of a sweep or of all of them.
+    #
+    def status(self, sweep = None):
+        if sweep is None:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        else:
+            rows = self.db.execute("SELECT state, COUNT(*) FROM jobs WHERE sweep = ? GROUP BY state", (sweep,))
+        return dict(rows.fetchall())
+
+######################################
+
+#
+# Renews the lease of a job in a background thread while the job runs.
+#
+class LeaseKeeper(threading.Thread):
+    def __init__(self, filename, lease, id, worker):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.filename = filename
+        self.lease = lease
+        self.id = id
+        self.worker = worker
+        self.stopped = threading.Event()
+
+    def run(self):
+        # SQLite connections cannot be shared between threads
+        broker = Broker(self.filename, self.lease)
+        try:
+            while not self.stopped.wait(self.lease / 3.0):
+                if not broker.renew(self.id, self.worker):
+                    break
+        finally:
+            broker.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+#
+# Takes and runs jobs from the broker until there are none left for `idleTimeout`
+# seconds (forever by default). Returns the number of jobs run.
+#
+def work(filename, poll = 1.0, idleTimeout = None, lease = LEASE, maxAttempts = MAX_ATTEMPTS):
+    broker = Broker(filename, lease, maxAttempts)
+    worker = workerName()
+    count = 0
+    idleSince = time.time()
+    try:
+        while True:
+            claimed = broker.claim(worker)
+            if claimed is None:
+                if idleTimeout is not None and time.time() - idleSince >= idleTimeout:
+                    return count
+                time.sleep(poll)
+                continue
+            id, job = claimed
+            keeper = LeaseKeeper(filename, lease, id, worker)
+            keeper.start()
+            try:
+                result = jobs.runJobSafe(job)
+            finally:
+                keeper.stop()
+            result["host"] = socket.gethostname()
+            broker.complete(id, worker, result)
+            count += 1
+            idleSince = time.time()
+    finally:
+        broker.close()
+
+#
+# Runs `processes` workers (all CPUs by default) on this host.
+#
+def workers(filename, processes = None, idleTimeout = None):
+    import multiprocessing
+    if processes == 1:
+        return work(filename, idleTimeout = idleTimeout)
+    processes = processes or multiprocessing.cpu_count()
+    pool = [multiprocessing.Process(target = work, args = (filename,), kwargs = {"idleTimeout": idleTimeout})
+            for i in range(processes)]
+    for p in pool:
+        p.start()
+    for p in pool:
+        p.join()
+
+######################################
+
+#
+# Submits the jobs to the broker and yields their results in the order in which
+# they complete, like `jobs.runJobs()`. The jobs are run by the workers.
+#
+def runJobs(filename, jobList, poll = 1.0, progress = None, lease = LEASE, maxAttempts = MAX_ATTEMPTS):
+    jobList = list(jobList)
+    broker = Broker(filename, lease, maxAttempts)
+    try:
+        sweep = broker.submit(jobList)
+        seq = 0
+        received = 0
+        while received < len(jobList):
+            results = broker.results(sweep, seq)
+            if not results:
+                time.sleep(poll)
+                continue
+            for seq, result in results:
+                received += 1
+                if progress is not None:
+                    progress.jobDone(result)
+                yield result
+    finally:
+        broker.close()
+
+######################################
+
+#
+# Runs a sweep through a temporary database with a worker that is killed during its
+# job, two groups of workers that take over, and a job that always fails. Checks that
+# every job gets exactly one result, that the lost job is run again and gives the same
+# result as in this process, and that the failing job is given up after `maxAttempts`.
+#
+def selfCheck(lease = 2.0, maxAttempts = 3):
+    import tempfile, shutil, multiprocessing
+    directory = tempfile.mkdtemp()
+    filename = os.path.join(directory, "check.db")
+    jobList = [jobs.makeJob("simulateAny", [[6] * 4, [0.7] * 4, 0.7, sim.ALGORITHM_CONTIKI, 80, ss],
+                            seed = 1, id = ss) for ss in range(0, 40, 5)]
+    for job in jobList:
+        job["config"]["NUM_SLOTFRAMES"] = 200
+    # the first job runs long enough for its worker to be killed during it
+    jobList[0]["config"]["NUM_SLOTFRAMES"] = 20000
+    jobList.append({"function": "missing", "args": [[1]], "id": "bad"})
+    errors = []
+    try:
+        broker = Broker(filename, lease, maxAttempts)
+        sweep = broker.submit(jobList)
+
+        victim = multiprocessing.Process(target = work, args = (filename,),
+                                         kwargs = {"lease": lease, "maxAttempts": maxAttempts})
+        victim.start()
+        while not broker.status(sweep).get("running"):
+            time.sleep(0.05)
+        victim.terminate()
+        victim.join()
+        print("killed a worker during its job")
+
+        groups = [multiprocessing.Process(target = workers, args = (filename, 2, 2 * lease)) for i in range(2)]
+        for g in groups:
+            g.start()
+        results = []
+        while len(results) < len(jobList):
+            time.sleep(0.2)
+            results = [result for seq, result in broker.results(sweep)]
+        for g in groups:
+            g.join()
+
+        ids = sorted(str(r.get("id")) for r in results)
+        if ids != sorted(str(job["id"]) for job in jobList):
+            errors.append("results of the jobs {} instead of one per job".format(ids))
+        attempts = dict((json.loads(job)["id"], n) for job, n in broker.db.execute("SELECT job, attempts FROM jobs"))
+        if attempts[0] < 2:
+            errors.append("the job of the killed worker was not run again")
+        if attempts["bad"] != maxAttempts:
+            errors.append("the failing job was tried {} times, not {}".format(attempts["bad"], maxAttempts))
+        for r in results:
+            if r["id"] == "bad":
+                if "error" not in r:
+                    errors.append("the failing job has no error")
+                continue
+            local = jobs.runJob([job for job in jobList if job["id"] == r["id"]][0])
+            if "error" in r or r["pdr"] != local["pdr"] or r["txrx"] != local["txrx"]:
+                errors.append("the result of job {} differs from a local run".format(r["id"]))
+        print("{} results, job attempts {}, status {}".format(len(results), attempts, broker.status(sweep)))
+        broker.close()
+    finally:
+        shutil.rmtree(directory)
+    for e in errors:
+        print("FAILED:", e)
+    if not errors:
+        print("OK")
+    return not errors
+
+def main():
+    if len(sys.argv) == 2 and sys.argv[1] == "check":
+        sys.exit(0 if selfCheck() else 1)
+    if len(sys.argv) < 3 or sys.argv[1] not in ("worker", "status"):
+        print("usage: {} worker <database> [processes] | status <database> | check".format(sys.argv[0]))
+        sys.exit(1)
+    filename = sys.argv[2]
+    if sys.argv[1] == "worker":
+        workers(filename, int(sys.argv[3]) if len(sys.argv) > 3 else None)
+    else:
+        broker = Broker(filename)
+        print(json.dumps(broker.status(), sort_keys = True))
+        broker.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Long-lived simulation service.
+#
+# Starting the interpreter, warming up the PyPy JIT and importing the modules
+# costs more than many short simulations. The daemon keeps a pool of warmed-up
+# worker processes and runs the jobs it receives on them (see jobs.py for
+# the job format). Start it with:
+#
+#    pypy3 ./daemon.py [address] [processes]
+#
+# The address is either a path of a Unix socket (the default is ADDRESS) or
+# "host:port" for a TCP socket, which should be on localhost.
+#
+# The protocol is JSON lines: the client sends one job per line and the server
+# writes one result per line, in the order in which the jobs complete, with the
+# `id` of the job. The server finishes the connection when the client has closed
+# its side and all results are sent.
+#
+# The client functions `simulateDedicated`, `simulatePartial`, `simulateShared`
+# and `simulateAny` in this module have the same signatures as in sim.py and
+# take the settings (NUM_SLOTFRAMES etc.) from sim.py, so an experiment can use
+# them in place of the sim.py functions. If the daemon is not running, they
+# simulate in the current process. As the simulation runs in another process,
+# they return the result of the job (see `jobs.summarize()`) instead of the
+# Simulation, and traffic sources, which cannot be sent in a job, are rejected.
+#
+
+import sys, os, json, socket, threading, multiprocessing
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+import sim, jobs
+
+# The default address of the daemon
+ADDRESS = os.environ.get("TSCH_SIM_DAEMON", "/tmp/tsch-sim.sock")
+
+# Whether the client functions simulate locally if the daemon is not reachable
+FALLBACK_LOCAL = True
+
+######################################
+
+#
+# Runs a short simulation in each new worker process to load the code and warm up the JIT.
+#
+def warmUp():
+    job = jobs.makeJob("simulatePartial", [[5] * 4, [0.9] * 4, 0.7, sim.ALGORITHM_CONTIKI, 40, 8])
+    job["config"]["NUM_SLOTFRAMES"] = 50
+    jobs.runJob(job)
+
+def parseAddress(address):
+    if ":" in address and not address.startswith("/"):
+        host, port = address.rsplit(":", 1)
+        return socket.AF_INET, (host, int(port))
+    return socket.AF_UNIX, address
+
+######################################
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        lock = threading.Lock()
+        done = threading.Condition(lock)
+        state = {"pending": 0}
+
+        def send(result):
+            with lock:
+                try:
+                    self.wfile.write((json.dumps(result) + "\n").encode("utf-8"))
+                    self.wfile.flush()
+                except (IOError, OSError):
+                    pass # the client has gone away
+                state["pending"] -= 1
+                done.notify()
+
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job = json.loads(line.decode("utf-8"))
+                if not isinstance(job, dict):
+                    raise ValueError("not a JSON object")
+            except ValueError as e:
+                job = None
+                error = {"id": None, "error": "invalid job: {}".format(e)}
+            with lock:
+                state["pending"] += 1
+            if job is None:
+                send(error)
+            else:
+                # the error callback answers for the jobs that could not be run at all
+                def failed(e, id = job.get("id")):
+                    send({"id": id, "error": "{}: {}".format(type(e).__name__, e)})
+                kwargs = {"callback": send}
+                if sys.version_info[0] >= 3:
+                    kwargs["error_callback"] = failed
+                self.server.pool.apply_async(jobs.runJobSafe, (job,), **kwargs)
+
+        with lock:
+            while state["pending"] > 0:
+                done.wait()
+
+class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+#
+# Runs the daemon until interrupted.
+#
+def serve(address = ADDRESS, processes = None):
+    family, addr = parseAddress(address)
+    pool = multiprocessing.Pool(processes, warmUp)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.unlink(addr)
+        server = ThreadingUnixServer(addr, JobHandler)
+    else:
+        server = ThreadingTCPServer(addr, JobHandler)
+    server.pool = pool
+    print("Serving simulations on {} with {} worker processes".format(
+        address, processes or multiprocessing.cpu_count()))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        if family == socket.AF_UNIX and os.path.exists(addr):
+            os.unlink(addr)
+
+######################################
+
+#
+# Sends the jobs to the daemon and yields the results as they arrive.
+#
+def submit(jobList, address = None):
+    family, addr = parseAddress(address or ADDRESS)
+    s = socket.socket(family, socket.SOCK_STREAM)
+    try:
+        s.connect(addr)
+        # send from a separate thread, so that a large batch cannot deadlock
+        # with the results filling up the socket buffers
+        def sender():
+            for job in jobList:
+                s.sendall((json.dumps(job) + "\n").encode("utf-8"))
+            s.shutdown(socket.SHUT_WR)
+        t = threading.Thread(target = sender)
+        t.daemon = True
+        t.start()
+        f = s.makefile("rb")
+        for line in f:
+            yield json.loads(line.decode("utf-8"))
+        t.join()
+    finally:
+        s.close()
+
+#
+# Runs a single job on the daemon, or locally if the daemon is not running.
+#
+def runRemote(function, stats, args, trafficSources):
+    if trafficSources is not None:
+        raise ValueError("traffic sources cannot be sent to the daemon; use sim.{}".format(function))
+    job = jobs.makeJob(function, args)
+    try:
+        results = list(submit([job]))
+    except (IOError, OSError):
+        if not FALLBACK_LOCAL:
+            raise
+        results = [jobs.runJob(job)]
+    jobs.applyResult(stats, results[0])
+    return results[0]
+
+def simulateShared(stats, packetsPerGw, prrlist, ccaSuccessProb, total_shared, trafficSources = None):
+    return runRemote("simulateShared", stats, [packetsPerGw, prrlist, ccaSuccessProb, total_shared],
+                     trafficSources)
+
+def simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                    trafficSources = None):
+    return runRemote("simulatePartial", stats,
+                     [packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots], trafficSources)
+
+def simulateDedicated(stats, packetsPerGw, prrlist, adaptive, slots, slotsMax, trafficSources = None):
+    return runRemote("simulateDedicated", stats, [packetsPerGw, prrlist, adaptive, slots, slotsMax],
+                     trafficSources)
+
+def simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                trafficSources = None):
+    return runRemote("simulateAny", stats,
+                     [packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots], trafficSources)
+
+######################################
+
+def main():
+    address = sys.argv[1] if len(sys.argv) > 1 else ADDRESS
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    serve(address, processes)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Histograms of per-packet metrics: the delivery latency, the number of
+# retransmissions and the queue length seen by arriving packets.
+#
+# The histograms have log-linear buckets, like HDR histograms: the values
+# below 2**precision have a bucket each, and each further power of two is split
+# into 2**(precision-1) buckets, so the relative error of a bucket is at most
+# 2**(1-precision). Recording a value is O(1), the memory does not depend on
+# the number of values, and histograms with the same precision are merged by
+# adding their buckets, e.g. over replications or the results of workers.
+#
+# Usage:
+#
+#    stats = sim.Statistics(packetsPerGw)
+#    stats.histograms = histogram.PacketHistograms()
+#    sim.simulateDedicated(stats, ...)
+#    print(stats.histograms.total()["latency"].percentile(99))
+#
+
+from array import array
+
+# The values below 2**PRECISION are recorded exactly, the larger ones with a
+# relative error of at most 2**(1-PRECISION)
+PRECISION = 5
+
+# The metrics recorded for each gateway
+METRICS = ["latency", "retries", "queue"]
+
+######################################
+
+class Histogram:
+    def __init__(self, precision = PRECISION):
+        self.precision = precision
+        self.linear = 1 << precision
+        self.half = self.linear >> 1
+        self.counts = array('l')
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def bucket(self, value):
+        if value < self.linear:
+            return value
+        shift = value.bit_length() - self.precision
+        return self.linear + (shift - 1) * self.half + (value >> shift) - self.half
+
+    #
+    # The smallest and the largest value in a bucket.
+    #
+    def bounds(self, index):
+        if index < self.linear:
+            return index, index
+        shift = (index - self.linear) // self.half + 1
+        low = ((index - self.linear) % self.half + self.half) << shift
+        return low, low + (1 << shift) - 1
+
+    #
+    # Records a non-negative integer value `count` times.
+    #
+    def record(self, value, count = 1):
+        index = self.bucket(value)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += count
+        self.count += count
+        self.sum += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("cannot merge histograms with different precision")
+        if len(other.counts) > len(self.counts):
+            self.counts.extend([0] * (len(other.counts) - len(self.counts)))
+        for i in range(len(other.counts)):
+            self.counts[i] += other.counts[i]
+        self.count += other.count
+        self.sum += other.sum
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+        return self
+
+    def reset(self):
+        self.__init__(self.precision)
+
+    def mean(self):
+        return float(self.sum) / self.count if self.count else None
+
+    #
+    # The value below which `q` percent of the values are, up to the bucket resolution
+    # (the largest value of the bucket, but not more than the maximum).
+    #
+    def percentile(self, q):
+        if not self.count:
+            return None
+        target = max(1, q / 100.0 * self.count)
+        seen = 0
+        for i in range(len(self.counts)):
+            seen += self.counts[i]
+            if seen >= target:
+                return min(self.bounds(i)[1], self.max)
+        return self.max
+
+    #
+    # A JSON-compatible representation with the non-empty buckets only.
+    #
+    def toDict(self):
+        return {"precision": self.precision, "count": self.count, "sum": self.sum,
+                "min": self.min, "max": self.max,
+                "buckets": [[i, c] for i, c in enumerate(self.counts) if c]}
+
+    @staticmethod
+    def fromDict(d):
+        h = Histogram(d["precision"])
+        for i, c in d["buckets"]:
+            if i >= len(h.counts):
+                h.counts.extend([0] * (i + 1 - len(h.counts)))
+            h.counts[i] = c
+        h.count = d["count"]
+        h.sum = d["sum"]
+        h.min = d["min"]
+        h.max = d["max"]
+        return h
+
+######################################
+
+#
+# The histograms of one gateway, updated by the simulator.
+#
+class GwHistograms:
+    def __init__(self, precision = PRECISION):
+        self.histograms = dict((name, Histogram(precision)) for name in METRICS)
+        self.latency = self.histograms["latency"]
+        self.retries = self.histograms["retries"]
+        self.queue = self.histograms["queue"]
+
+    def __getitem__(self, name):
+        return self.histograms[name]
+
+    #
+    # A new packet arrives at a queue of `queueLength` packets.
+    #
+    def arrival(self, queueLength):
+        self.queue.record(queueLength)
+
+    def delivered(self, packet, asn):
+        self.latency.record(asn - packet.arrival)
+        self.retries.record(packet.tx - 1)
+
+    def merge(self, other):
+        for name in METRICS:
+            self.histograms[name].merge(other.histograms[name])
+        return self
+
+    def reset(self):
+        for h in self.histograms.values():
+            h.reset()
+
+#
+# The histograms of all gateways, attached to `Statistics.histograms`.
+# The latency is in timeslots, from the arrival to the successful transmission;
+# the latency and the retransmissions are recorded for the delivered packets.
+#
+class PacketHistograms:
+    def __init__(self, precision = PRECISION):
+        self.precision = precision
+        self.gws = {}
+
+    def forGw(self, gwId):
+        h = self.gws.get(gwId)
+        if h is None:
+            h = GwHistograms(self.precision)
+            self.gws[gwId] = h
+        return h
+
+    def reset(self):
+        for h in self.gws.values():
+            h.reset()
+
+    def merge(self, other):
+        for gwId, h in other.gws.items():
+            self.forGw(gwId).merge(h)
+        return self
+
+    #
+    # The histograms of all gateways merged.
+    #
+    def total(self):
+        h = GwHistograms(self.precision)
+        for gwHistograms in self.gws.values():
+            h.merge(gwHistograms)
+        return h
+
+    def toDict(self):
+        return {"precision": self.precision,
+                "gws": dict((str(gwId), dict((name, h[name].toDict()) for name in METRICS))
+                            for gwId, h in self.gws.items())}
+
+    @staticmethod
+    def fromDict(d):
+        result = PacketHistograms(d["precision"])
+        for gwId, metrics in d["gws"].items():
+            h = result.forGw(int(gwId))
+            for name in METRICS:
+                h[name].merge(Histogram.fromDict(metrics[name]))
+        return result
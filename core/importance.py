@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Importance sampling for rare packet loss.
+#
+# With good links and NUM_TX retransmissions, packet loss is so rare that
+# plain simulation needs a huge number of slotframes to estimate it. The
+# importance sampler makes the failures more likely: the failure probability
+# of each link-layer transmission is multiplied by `linkBias`, and the
+# probability of transmitting in a shared slot by `contentionBias`. Each biased
+# decision multiplies a likelihood ratio P(outcome) / P'(outcome), which is
+# then used to reweight the losses.
+#
+# A packet lost after NUM_TX failed transmissions is weighted by the product
+# of the likelihood ratios of its own transmissions. With constant PRR this
+# weight is the same for all such packets, so the estimate has a very low
+# variance. In shared slots, a transmitted packet is also weighted by the
+# likelihood ratio of the other gateways' decisions to transmit in that slot;
+# this is exact as long as the queues stay short, so that the transmission
+# probabilities themselves are not changed by the bias.
+#
+# A packet dropped because the queue is full depends on the whole history,
+# so these losses are estimated over regeneration cycles: a cycle ends when all
+# queues are empty at the same slot index of a slotframe (chosen automatically
+# after a few pilot slotframes), and a drop is weighted by the likelihood ratio
+# of the cycle so far. The cycles are independent for periodic and Poisson
+# traffic with non-adaptive schedules; the negotiated algorithm and adaptive
+# scheduling carry some state across cycles, so they are approximate.
+#
+# Biased failures make the queues longer, and with enough bias they never
+# empty, so there are no regeneration points. If all queues are empty in less
+# than `minRegenerationRate` of the pilot slotframes, the biases are halved and
+# the pilot is repeated (`linkBias` and `contentionBias` then hold the values
+# used); the pilot goes on until the queues have been empty at least once. If
+# there are drops but still no complete cycle at the end, `pdr()` and `stderr()`
+# raise an error instead of returning an estimate without them.
+#
+# CCA outcomes are not biased, and energy is not reweighted.
+#
+# Usage:
+#
+#    stats = sim.Statistics(packetsPerGw)
+#    stats.sampler = importance.ImportanceSampler(linkBias = 5)
+#    sim.simulateDedicated(stats, ...)
+#    print(stats.sampler.pdr(), stats.sampler.stderr())
+#
+
+import math
+
+######################################
+
+#
+# Splits a simulation run into regeneration cycles.
+# Also defines the hooks called by the simulator while a sampler is attached
+# to `Statistics.sampler`; the default hooks do not change the simulation.
+#
+class RegenerativeEstimator:
+    def __init__(self, pilotSlotframes = 10):
+        self.pilotSlotframes = pilotSlotframes
+        self.pilotFrames = 0
+        self.emptyCount = []
+        self.regenerationSlot = None
+        self.inCycle = False
+        self.cycles = 0
+
+    #
+    # Link-layer transmission of `packet` with success probability `p`; `r` is uniform on [0, 1).
+    #
+    def linkOk(self, r, p, packet):
+        return r <= p
+
+    #
+    # Decision of `gw` to transmit in a shared slot with probability `p`.
+    #
+    def transmitOk(self, r, p, gw):
+        return r <= p
+
+    #
+    # Called after all gateways have decided whether to transmit in a shared slot.
+    #
+    def contention(self, packets):
+        pass
+
+    #
+    # A new packet is dropped because the queue of `gw` is full.
+    #
+    def overflow(self, gw):
+        pass
+
+    def delivered(self, packet):
+        pass
+
+    #
+    # `packet` is dropped after NUM_TX transmissions.
+    #
+    def lost(self, packet):
+        pass
+
+    def startCycle(self, stats, gws):
+        pass
+
+    def endCycle(self, stats, gws):
+        pass
+
+    #
+    # Called by the simulator at the end of each timeslot.
+    #
+    def slotEnd(self, slotIndex, stats, gws):
+        if self.regenerationSlot is None:
+            self.pilot(slotIndex, gws)
+            return
+        if slotIndex != self.regenerationSlot:
+            return
+        for gw in gws:
+            if gw.queue:
+                return
+        if self.inCycle:
+            self.endCycle(stats, gws)
+            self.cycles += 1
+        self.inCycle = True
+        self.startCycle(stats, gws)
+
+    #
+    # The regeneration points must be at the same position in the slotframe,
+    # so that the traffic and the schedule are in the same state at each of them.
+    # During the first `pilotSlotframes` slotframes, counts how often all queues
+    # are empty at each slot index, then uses the slot where it happens most often.
+    # If the queues were never all empty, the pilot is repeated.
+    #
+    def pilot(self, slotIndex, gws):
+        if slotIndex >= len(self.emptyCount):
+            self.emptyCount.extend([0] * (slotIndex + 1 - len(self.emptyCount)))
+        elif slotIndex == 0:
+            self.pilotFrames += 1
+            if self.pilotFrames >= self.pilotSlotframes:
+                best = max(self.emptyCount)
+                if self.pilotEnd(best / float(self.pilotFrames)) and best > 0:
+                    self.regenerationSlot = self.emptyCount.index(best)
+                    return
+                # pilot again
+                self.pilotFrames = 0
+                self.emptyCount = [0] * len(self.emptyCount)
+        for gw in gws:
+            if gw.queue:
+                return
+        self.emptyCount[slotIndex] += 1
+
+    #
+    # Called at the end of the pilot with the fraction of the pilot slotframes in
+    # which all queues were empty at the best slot index; returns False to repeat the pilot.
+    #
+    def pilotEnd(self, rate):
+        return True
+
+######################################
+
+#
+# Ratio estimate sum(Y) / sum(X) and its standard error (delta method),
+# from the sums of Y, X, Y*Y, X*X and X*Y over `n` independent samples.
+#
+def ratio(n, sy, sx, syy, sxx, sxy):
+    if sx == 0:
+        return None, None
+    r = sy / sx
+    if n < 2:
+        return r, None
+    # sample variance of Y - r * X, whose mean is zero
+    var = (syy - 2 * r * sxy + r * r * sxx) / (n - 1)
+    return r, math.sqrt(max(var, 0.0) / n) / (sx / n)
+
+######################################
+
+class ImportanceSampler(RegenerativeEstimator):
+    def __init__(self, linkBias = 4.0, contentionBias = 1.0, maxFailure = 0.9, maxTransmit = 0.95,
+                 pilotSlotframes = 10, minRegenerationRate = 0.2):
+        RegenerativeEstimator.__init__(self, pilotSlotframes)
+        self.linkBias = linkBias
+        self.contentionBias = contentionBias
+        self.minRegenerationRate = minRegenerationRate
+        self.maxFailure = maxFailure
+        self.maxTransmit = maxTransmit
+        # likelihood ratio of the current cycle so far
+        self.weight = 1.0
+        # likelihood ratios of the transmission decisions in the current shared slot
+        self.decisions = []
+        self.numGws = 0
+        self.gwData = {}
+        self.startGenerated = []
+
+    #
+    # Halves the biases while the queues rarely empty; each packet keeps the likelihood
+    # ratio of the bias it was simulated with, so the estimates stay unbiased.
+    #
+    def pilotEnd(self, rate):
+        if rate >= self.minRegenerationRate or (self.linkBias <= 1.0 and self.contentionBias <= 1.0):
+            return True
+        self.linkBias = max(1.0, self.linkBias / 2.0)
+        self.contentionBias = max(1.0, self.contentionBias / 2.0)
+        return False
+
+    #
+    # Raises an error if there are queue drops but no regeneration cycles to estimate them.
+    #
+    def checkCycles(self):
+        if self.cycles == 0 and any(s["drops"] for s in self.gwData.values()):
+            if self.regenerationSlot is None:
+                raise RuntimeError("queue drops without any regeneration cycle: the queues were never all "
+                                   "empty, even with linkBias {} and contentionBias {}; the network is "
+                                   "overloaded".format(self.linkBias, self.contentionBias))
+            raise RuntimeError("queue drops without any complete regeneration cycle: the queues were all "
+                               "empty during the pilot, but not again at slot {}; use a smaller linkBias "
+                               "or contentionBias".format(self.regenerationSlot))
+
+    def gwStats(self, gwId):
+        s = self.gwData.get(gwId)
+        if s is None:
+            # finished packets that were not dropped on arrival, and sums of their weighted losses;
+            # all drops on arrival; and the per-cycle sums for the ratio estimator of the
+            # drops on arrival (Y = sum of drop weights, X = cycle weight * arrivals)
+            s = {"packets": 0, "w": 0.0, "ww": 0.0, "drops": 0, "cycleDrops": 0.0,
+                 "y": 0.0, "x": 0.0, "yy": 0.0, "xx": 0.0, "xy": 0.0}
+            self.gwData[gwId] = s
+            self.numGws = max(self.numGws, gwId + 1)
+        return s
+
+    def linkOk(self, r, p, packet):
+        if p >= 1.0 or p <= 0.0:
+            return r <= p
+        q = 1.0 - min(max((1.0 - p) * self.linkBias, 1.0 - p), self.maxFailure)
+        if r <= q:
+            lr = p / q
+            ok = True
+        else:
+            lr = (1.0 - p) / (1.0 - q)
+            ok = False
+        packet.weight *= lr
+        self.weight *= lr
+        return ok
+
+    def transmitOk(self, r, p, gw):
+        if p >= 1.0 or p <= 0.0:
+            return r <= p
+        q = min(max(p * self.contentionBias, p), self.maxTransmit)
+        if r <= q:
+            lr = p / q
+            ok = True
+        else:
+            lr = (1.0 - p) / (1.0 - q)
+            ok = False
+        self.decisions.append((gw.id, lr))
+        self.weight *= lr
+        return ok
+
+    def contention(self, packets):
+        for packet in packets:
+            for gwId, lr in self.decisions:
+                if gwId != packet.gw.id:
+                    packet.weight *= lr
+        self.decisions = []
+
+    def overflow(self, gw):
+        s = self.gwStats(gw.id)
+        s["drops"] += 1
+        if self.inCycle:
+            s["cycleDrops"] += self.weight
+
+    def delivered(self, packet):
+        self.gwStats(packet.gw.id)["packets"] += 1
+
+    def lost(self, packet):
+        s = self.gwStats(packet.gw.id)
+        s["packets"] += 1
+        s["w"] += packet.weight
+        s["ww"] += packet.weight * packet.weight
+
+    def startCycle(self, stats, gws):
+        self.weight = 1.0
+        self.startGenerated = [gw.numOkPackets + gw.numLostPackets for gw in gws]
+        for gw in gws:
+            self.gwStats(gw.id)["cycleDrops"] = 0.0
+
+    def endCycle(self, stats, gws):
+        for i in range(len(gws)):
+            s = self.gwStats(gws[i].id)
+            # all packets of the cycle have been delivered or lost
+            y = s["cycleDrops"]
+            x = self.weight * (gws[i].numOkPackets + gws[i].numLostPackets - self.startGenerated[i])
+            s["y"] += y
+            s["x"] += x
+            s["yy"] += y * y
+            s["xx"] += x * x
+            s["xy"] += x * y
+
+    #
+    # The estimated probability that a packet of the gateway is dropped because of a full queue,
+    # and its standard error.
+    #
+    def overflowProbability(self, gwId):
+        s = self.gwStats(gwId)
+        if s["drops"] == 0:
+            return 0.0, 0.0
+        return ratio(self.cycles, s["y"], s["x"], s["yy"], s["xx"], s["xy"])
+
+    #
+    # The estimated probability that a packet that got in the queue is dropped after NUM_TX
+    # transmissions, and its standard error.
+    #
+    def retryLossProbability(self, gwId):
+        s = self.gwStats(gwId)
+        n = s["packets"]
+        if n == 0:
+            return None, None
+        m = s["w"] / n
+        if n < 2:
+            return m, None
+        var = (s["ww"] - n * m * m) / (n - 1)
+        return m, math.sqrt(max(var, 0.0) / n)
+
+    #
+    # The estimated loss probability of a gateway and its standard error,
+    # or None if there is not enough data.
+    #
+    def lossProbability(self, gwId):
+        o, oe = self.overflowProbability(gwId)
+        r, re = self.retryLossProbability(gwId)
+        if o is None or r is None:
+            return None, None
+        loss = o + (1.0 - o) * r
+        if oe is None or re is None:
+            return loss, None
+        return loss, math.sqrt(oe * oe + re * re)
+
+    #
+    # The estimated PDR in percent, averaged over the gateways like `Statistics.pdr`.
+    #
+    def pdr(self):
+        self.checkCycles()
+        losses = [self.lossProbability(i)[0] for i in range(self.numGws)]
+        losses = [l for l in losses if l is not None]
+        if not losses:
+            return None
+        return 100.0 * (1.0 - sum(losses) / len(losses))
+
+    #
+    # Standard error of `pdr()`, in percent, treating the gateways as independent.
+    #
+    def stderr(self):
+        self.checkCycles()
+        errors = [self.lossProbability(i)[1] for i in range(self.numGws)]
+        errors = [e for e in errors if e is not None]
+        if not errors:
+            return None
+        return 100.0 * math.sqrt(sum(e * e for e in errors)) / len(errors)
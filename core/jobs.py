@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Simulation jobs described as plain JSON-compatible dictionaries, so that
+# they can be sent to other processes or machines:
+#
+#    {"function": "simulatePartial",
+#     "args": [packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots],
+#     "config": {"NUM_SLOTFRAMES": 100, ...},
+#     "seed": 1,
+#     "id": "any identifier",
+#     "histograms": true}
+#
+# `args` are the arguments of the sim.simulate* function after `stats`.
+# `config` holds the module-level settings of sim.py; `seed`, `id` and `histograms`
+# (whether to record the per-packet histograms, see histogram.py) are optional.
+# The result of a job is a dictionary with the Statistics counters and the
+# per-gateway counters, which can be applied back to a Statistics object.
+#
+
+import random, time, os
+
+import sim
+import histogram
+
+FUNCTIONS = ["simulateDedicated", "simulatePartial", "simulateShared", "simulateAny", "simulateSlotframe"]
+
+# The module-level settings of sim.py that are sent with each job
+CONFIG = ["DO_CCA", "NUM_SLOTFRAMES", "NUM_WARMUP_SLOTFRAMES", "SLOTFRAME_SIZE", "NUM_TX", "MAX_QUEUE"]
+
+COUNTERS = ["sleeping", "idlelistening", "txrx", "collisionsTx", "collisionsRx", "pdr", "asn", "traffic"]
+
+######################################
+
+def currentConfig():
+    return dict((name, getattr(sim, name)) for name in CONFIG)
+
+#
+# Creates a job calling `sim.<function>(stats, *args)` with the current settings.
+#
+def makeJob(function, args, seed = None, id = None, histograms = False):
+    if function not in FUNCTIONS:
+        raise ValueError("unknown simulation function: {}".format(function))
+    job = {"function": function, "args": list(args), "config": currentConfig()}
+    if seed is not None:
+        job["seed"] = seed
+    if id is not None:
+        job["id"] = id
+    if histograms:
+        job["histograms"] = True
+    return job
+
+#
+# Runs a job in this process and returns its result.
+# The settings of sim.py are restored afterwards.
+#
+def runJob(job):
+    function = job["function"]
+    if function not in FUNCTIONS:
+        raise ValueError("unknown simulation function: {}".format(function))
+    oldConfig = currentConfig()
+    start = time.time()
+    try:
+        for name, value in job.get("config", {}).items():
+            if name in CONFIG:
+                setattr(sim, name, value)
+        if job.get("seed") is not None:
+            random.seed(job["seed"])
+        args = job["args"]
+        stats = sim.Statistics(args[0])
+        if job.get("histograms"):
+            stats.histograms = histogram.PacketHistograms()
+        getattr(sim, function)(stats, *args)
+        result = summarize(stats)
+        result["numSlotframes"] = sim.NUM_SLOTFRAMES
+        result["slots"] = sim.NUM_SLOTFRAMES * sim.SLOTFRAME_SIZE
+    finally:
+        for name, value in oldConfig.items():
+            setattr(sim, name, value)
+    result["id"] = job.get("id")
+    result["worker"] = os.getpid()
+    result["start"] = start
+    result["time"] = time.time() - start
+    return result
+
+#
+# Like `runJob`, but returns the error message in the result instead of raising.
+#
+def runJobSafe(job):
+    try:
+        return runJob(job)
+    except Exception as e:
+        id = job.get("id") if isinstance(job, dict) else None
+        return {"id": id, "error": "{}: {}".format(type(e).__name__, e)}
+
+#
+# Converts the results in a Statistics object to a dictionary.
+#
+def summarize(stats):
+    result = dict((name, getattr(stats, name)) for name in COUNTERS)
+    result["energy"] = stats.energy()
+    try:
+        result["enef"] = stats.enef()
+    except ZeroDivisionError:
+        result["enef"] = None
+    result["gws"] = [{"id": gw.id, "prr": gw.prr, "numOkPackets": gw.numOkPackets,
+                      "numLostPackets": gw.numLostPackets, "u": gw.u, "aslot": gw.aslot}
+                     for gw in stats.gwlist]
+    if stats.histograms is not None:
+        result["histograms"] = stats.histograms.toDict()
+    return result
+
+#
+# Fills a Statistics object from a job result.
+#
+def applyResult(stats, result):
+    if "error" in result:
+        raise RuntimeError("simulation job failed: " + result["error"])
+    for name in COUNTERS:
+        setattr(stats, name, result[name])
+    stats.gwlist = []
+    for g in result["gws"]:
+        gw = sim.Gw(g["id"], g["prr"], g["aslot"], g["aslot"])
+        gw.numOkPackets = g["numOkPackets"]
+        gw.numLostPackets = g["numLostPackets"]
+        gw.u = g["u"]
+        stats.gwlist.append(gw)
+    if "histograms" in result:
+        stats.histograms = histogram.PacketHistograms.fromDict(result["histograms"])
+    return stats
+
+######################################
+
+#
+# Runs the jobs in a pool of `processes` worker processes (all CPUs by default)
+# and yields their results in the order in which they complete.
+# With a single process, the jobs are run in this process.
+# The completed jobs are counted in the optional `progress` meter (see progress.py).
+#
+def runJobs(jobs, processes = None, progress = None):
+    if processes == 1:
+        for job in jobs:
+            result = runJobSafe(job)
+            if progress is not None:
+                progress.jobDone(result)
+            yield result
+        return
+    import multiprocessing
+    pool = multiprocessing.Pool(processes)
+    try:
+        for result in pool.imap_unordered(runJobSafe, jobs):
+            if progress is not None:
+                progress.jobDone(result)
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
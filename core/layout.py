@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Optimization of the slotframe layout: the positions of the dedicated slots of
+# each gateway and of the shared slots, for a given number of each.
+#
+# The search is simulated annealing over swaps of two slots with different
+# owners, starting from the layout of `simulateAny()`. A swap keeps the number
+# of slots of each owner, and moves a shared slot, changes the spacing of the
+# dedicated slots of a gateway, or both.
+#
+# The candidates are not simulated from scratch. The warm-up is simulated once
+# for each replication and saved with `Simulation.snapshot()`; a candidate is
+# evaluated by restoring the snapshots, switching to its slotframe and
+# simulating `evalSlotframes` slotframes. As the random number generator is
+# restored too, all candidates see the same traffic and link outcomes (common
+# random numbers), so the differences between their results come from the
+# layout rather than from the noise. The results are cached by layout.
+#
+# A layout found this way is tuned to the random numbers of the evaluation;
+# with `validate` > 0, the best and the initial layout are compared again on
+# independent full runs.
+#
+# Usage:
+#
+#    result = layout.optimizeLayout([14] * 4, [0.9] * 4, 0.7, sim.ALGORITHM_CONTIKI, 80, 20)
+#    print(result.pdrGain, result.energyGain, result.slotframe)
+#
+
+import random, copy, math
+
+import sim
+
+######################################
+
+#
+# The number of slots that the algorithm does not support: the negotiated
+# algorithm does not support several subsequent shared slots. The default layout
+# may have some, so the search only rejects the moves that add more.
+#
+def violations(slotframe, algorithm):
+    count = 0
+    if algorithm == sim.ALGORITHM_CONTIKI_NEGOTIATED:
+        for si in range(len(slotframe)):
+            if slotframe[si] == sim.SHARED and slotframe[(si + 1) % len(slotframe)] == sim.SHARED:
+                count += 1
+    return count
+
+#
+# Returns a copy of the slotframe with a random swap of two slots with different
+# owners, or None if the slotframe has a single owner. At least one of the slots is active.
+#
+def neighbour(slotframe, rng):
+    active = [si for si in range(len(slotframe)) if slotframe[si] != sim.INACTIVE]
+    if not active:
+        return None
+    for attempt in range(100):
+        i = rng.choice(active)
+        j = rng.randrange(len(slotframe))
+        if slotframe[i] != slotframe[j]:
+            candidate = list(slotframe)
+            candidate[i], candidate[j] = candidate[j], candidate[i]
+            return candidate
+    return None
+
+#
+# The dedicated slots of each gateway and the gaps between them, for reporting.
+#
+def spacing(slotframe, numGws):
+    result = []
+    for gw in range(numGws):
+        positions = [si for si in range(len(slotframe)) if slotframe[si] == gw]
+        gaps = [(positions[(k + 1) % len(positions)] - positions[k]) % len(slotframe) or len(slotframe)
+                for k in range(len(positions))]
+        result.append(gaps)
+    return result
+
+######################################
+
+#
+# Evaluates layouts from saved warm-up states with common random numbers.
+# The score is the PDR in percent, or the energy of a NUM_SLOTFRAMES run with
+# the "energy" objective; higher is better, so the energy is negated.
+#
+class LayoutEvaluator:
+    def __init__(self, packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe,
+                 evalSlotframes = 50, warmupSlotframes = 10, replications = 2, seed = 0,
+                 objective = "pdr", trafficSources = None):
+        if objective not in ("pdr", "energy"):
+            raise ValueError("unknown objective: {}".format(objective))
+        self.evalSlotframes = evalSlotframes
+        self.objective = objective
+        self.cache = {}
+        self.evaluations = 0
+        self.snapshots = []
+        oldSlotframes = sim.NUM_SLOTFRAMES
+        oldWarmup = sim.NUM_WARMUP_SLOTFRAMES
+        try:
+            sim.NUM_SLOTFRAMES = warmupSlotframes
+            sim.NUM_WARMUP_SLOTFRAMES = 0
+            for r in range(replications):
+                random.seed(seed + r)
+                stats = sim.Statistics(packetsPerGw)
+                # the traffic sources keep state, so each replication starts from a fresh copy
+                sources = copy.deepcopy(trafficSources)
+                simulation = sim.simulateSlotframe(stats, packetsPerGw, prrlist, ccaSuccessProb,
+                                                   algorithm, slotframe, sources)
+                self.snapshots.append(simulation.snapshot())
+        finally:
+            sim.NUM_SLOTFRAMES = oldSlotframes
+            sim.NUM_WARMUP_SLOTFRAMES = oldWarmup
+
+    #
+    # Returns (score, pdr, energy) of the slotframe, averaged over the replications.
+    #
+    def evaluate(self, slotframe):
+        key = tuple(slotframe)
+        if key in self.cache:
+            return self.cache[key]
+        pdr = 0.0
+        energy = 0.0
+        for snapshot in self.snapshots:
+            s = sim.restore(snapshot)
+            s.slotframe = list(slotframe)
+            s.isSharedSlotReserved = None
+            s.resetCounters()
+            s.run(self.evalSlotframes)
+            s.finish()
+            pdr += s.stats.pdr
+            energy += s.stats.energy() * sim.NUM_SLOTFRAMES / float(self.evalSlotframes)
+        pdr /= len(self.snapshots)
+        energy /= len(self.snapshots)
+        score = pdr if self.objective == "pdr" else -energy
+        self.evaluations += 1
+        self.cache[key] = (score, pdr, energy)
+        return self.cache[key]
+
+######################################
+
+class LayoutResult:
+    def __init__(self, slotframe, initial, best, baseline, evaluations, history):
+        self.slotframe = slotframe
+        self.initialSlotframe = initial
+        self.score, self.pdr, self.energy = best
+        self.baselineScore, self.baselinePdr, self.baselineEnergy = baseline
+        # the PDR gain in percentage points and the energy saved in J
+        self.pdrGain = self.pdr - self.baselinePdr
+        self.energyGain = self.baselineEnergy - self.energy
+        self.evaluations = evaluations
+        # (iteration, best score) each time the best layout improved
+        self.history = history
+        # (pdr, energy) of the best and the initial layout on independent runs, see `validateLayout()`
+        self.validated = None
+        self.validatedBaseline = None
+
+    def __repr__(self):
+        return "PDR {:.2f} ({:+.2f}), energy {:.4f} J ({:+.4f}), {} evaluations".format(
+            self.pdr, self.pdrGain, self.energy, -self.energyGain, self.evaluations)
+
+#
+# Simulates the slotframe `repeat` times for NUM_SLOTFRAMES from scratch and returns
+# the mean (pdr, energy). Runs with the same seeds are comparable across layouts.
+#
+def validateLayout(packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe, repeat,
+                   seed = 0, trafficSources = None):
+    pdr = 0.0
+    energy = 0.0
+    for r in range(repeat):
+        random.seed(seed + r)
+        stats = sim.Statistics(packetsPerGw)
+        sim.simulateSlotframe(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe,
+                              copy.deepcopy(trafficSources))
+        pdr += stats.pdr
+        energy += stats.energy()
+    return pdr / repeat, energy / repeat
+
+#
+# Searches for the layout of `totalSlots` active slots, `sharedSlots` of which are
+# shared, with the best score (see `LayoutEvaluator`). The search starts from
+# `slotframe`, or from the layout of `simulateAny()`, and makes `iterations` moves;
+# the temperature falls geometrically from `temperature` to `finalTemperature`,
+# in units of the score. The state of the random number generator is kept.
+#
+def optimizeLayout(packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                   iterations = 200, evalSlotframes = 50, warmupSlotframes = 10, replications = 2,
+                   objective = "pdr", seed = 0, slotframe = None, trafficSources = None,
+                   temperature = 0.5, finalTemperature = 0.01, validate = 0):
+    randomState = random.getstate()
+    try:
+        if slotframe is None:
+            random.seed(seed)
+            slotframe = sim.anySlotframe(len(packetsPerGw), totalSlots, sharedSlots)
+        # the moves use their own generator, the simulations the global one
+        rng = random.Random(seed)
+        evaluator = LayoutEvaluator(packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe,
+                                    evalSlotframes, warmupSlotframes, replications, seed,
+                                    objective, trafficSources)
+
+        baseline = evaluator.evaluate(slotframe)
+        current, currentResult = slotframe, baseline
+        currentViolations = violations(slotframe, algorithm)
+        best, bestResult = slotframe, baseline
+        history = [(0, baseline[0])]
+        for k in range(iterations):
+            t = temperature * (finalTemperature / float(temperature)) ** (k / float(max(1, iterations - 1)))
+            candidate = neighbour(current, rng)
+            if candidate is None:
+                break
+            candidateViolations = violations(candidate, algorithm)
+            if candidateViolations > currentViolations:
+                continue
+            result = evaluator.evaluate(candidate)
+            delta = result[0] - currentResult[0]
+            if delta >= 0 or rng.random() < math.exp(delta / t):
+                current, currentResult = candidate, result
+                currentViolations = candidateViolations
+                if result[0] > bestResult[0]:
+                    best, bestResult = candidate, result
+                    history.append((k + 1, result[0]))
+
+        layoutResult = LayoutResult(best, slotframe, bestResult, baseline, evaluator.evaluations, history)
+        if validate:
+            # seeds not used by the search
+            validationSeed = seed + replications
+            layoutResult.validated = validateLayout(packetsPerGw, prrlist, ccaSuccessProb, algorithm,
+                                                    best, validate, validationSeed, trafficSources)
+            layoutResult.validatedBaseline = validateLayout(packetsPerGw, prrlist, ccaSuccessProb, algorithm,
+                                                            slotframe, validate, validationSeed, trafficSources)
+        return layoutResult
+    finally:
+        random.setstate(randomState)
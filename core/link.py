@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Time-varying link models.
+#
+# A link model can be passed in `prrlist` instead of a constant PRR. The
+# simulator calls `prrAt(asn)` to get the PRR of the link for each transmission
+# (with non-decreasing ASNs), and uses `meanPrr()` wherever a single value is
+# needed. Link models hold state, so use new objects for each simulation run.
+#
+
+import math, random
+
+######################################
+
+#
+# Number of slots spent in a state with the given mean sojourn time (in slots):
+# a geometric random variable >= 1, sampled by inversion.
+#
+def geometric(mean):
+    if mean <= 1.0:
+        return 1
+    u = random.random()
+    return 1 + int(math.log(1.0 - u) / math.log(1.0 - 1.0 / mean))
+
+#
+# Gilbert-Elliott bursty link. The link alternates between a good state with
+# PRR `prrGood` and a bad state with PRR `prrBad`, staying in them for
+# geometrically distributed numbers of slots with means `meanGood` and
+# `meanBad`. The state changes are sampled as sojourn times and applied lazily
+# when the link is used, so a link costs O(1) per transmission plus O(1) per
+# state change, not per slot.
+#
+class GilbertElliottLink:
+    def __init__(self, prrGood, prrBad, meanGood, meanBad):
+        self.prrGood = prrGood
+        self.prrBad = prrBad
+        self.meanGood = float(meanGood)
+        self.meanBad = float(meanBad)
+        # start in the stationary distribution
+        self.good = random.random() < self.meanGood / (self.meanGood + self.meanBad)
+        self.nextChange = geometric(self.meanGood if self.good else self.meanBad)
+
+    def prrAt(self, asn):
+        while asn >= self.nextChange:
+            self.good = not self.good
+            self.nextChange += geometric(self.meanGood if self.good else self.meanBad)
+        return self.prrGood if self.good else self.prrBad
+
+    def meanPrr(self):
+        return (self.meanGood * self.prrGood + self.meanBad * self.prrBad) / (self.meanGood + self.meanBad)
+
+    def __repr__(self):
+        return "GE({}, {}, {}, {})".format(self.prrGood, self.prrBad, self.meanGood, self.meanBad)
+
+#
+# Creates `n` independent Gilbert-Elliott links, e.g. for the `prrlist` of a simulation.
+#
+def gilbertElliottLinks(n, prrGood, prrBad, meanGood, meanBad):
+    return [GilbertElliottLink(prrGood, prrBad, meanGood, meanBad) for i in range(n)]
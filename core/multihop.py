@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Multihop networks: trees and DAGs of nodes forwarding packets towards sinks.
+#
+# The topology is stored in compressed sparse row (CSR) arrays: the links from
+# node `u` are the indexes `offsets[u] .. offsets[u+1] - 1` of the arrays
+# `targets` (the next hop) and `prr` (the PRR of the link). A node without
+# links is a sink. With more than one link (a DAG), a node forwards the packet
+# at the head of its queue in whichever of its cells comes first.
+#
+# The schedule is stored in the same way: the cells of timeslot `s` are the
+# indexes `offsets[s] .. offsets[s+1] - 1` of the arrays `links` and `channels`.
+# Each cell is dedicated to one link. The simulator only looks at the cells
+# of the current timeslot, so the cost of a timeslot is proportional to the
+# number of its cells, not to the size of the network.
+#
+# In each timeslot a node uses a single radio: it sends at most one packet,
+# and a node that sends cannot receive. A receiver listens on the channel of
+# its first cell with a transmission; more than one transmission on that
+# channel is a collision. Each node has a queue of MAX_QUEUE packets, and a
+# packet is retransmitted up to NUM_TX times on each hop. A receiver with a
+# full queue does not acknowledge the packet, which counts as a failed
+# transmission.
+#
+# Every link has at least one cell, and a node has at most one cell in a
+# timeslot, so the slotframe must have at least as many timeslots as the
+# cells of the busiest node, and `numChannels` times as many cells as all the
+# links together; see `requiredSlotframeSize()`. Large networks with light
+# traffic need a correspondingly large slotframe.
+#
+# Usage:
+#
+#    sim.SLOTFRAME_SIZE = 1009
+#    topology = multihop.randomTree(1000, maxChildren = 4)
+#    packetsPerNode = [0] + [0.05] * 999
+#    stats = sim.Statistics(packetsPerNode)
+#    multihop.simulateMultihop(stats, topology, packetsPerNode, numChannels = 16,
+#                              trafficSources = traffic.poissonSources(packetsPerNode, sim.SLOTFRAME_SIZE))
+#    print(stats.pdr)
+#
+
+import random, math
+from array import array
+from collections import deque
+
+import sim
+
+######################################
+
+class Topology:
+    def __init__(self, numNodes, offsets, targets, prr):
+        if len(offsets) != numNodes + 1 or len(targets) != len(prr) or offsets[-1] != len(targets):
+            raise ValueError("inconsistent topology arrays")
+        self.numNodes = numNodes
+        self.offsets = array('l', offsets)
+        self.targets = array('l', targets)
+        self.prr = array('d', prr)
+        # the source node of each link
+        self.sources = array('l', [0] * len(targets))
+        for u in range(numNodes):
+            for k in range(self.offsets[u], self.offsets[u + 1]):
+                self.sources[k] = u
+        self.order = self.topologicalOrder()
+
+    #
+    # Creates a topology from a list of (source, target, prr) links.
+    #
+    @staticmethod
+    def fromLinks(numNodes, links):
+        links = sorted(links, key = lambda link: link[0])
+        offsets = [0] * (numNodes + 1)
+        for source, target, prr in links:
+            if not (0 <= source < numNodes and 0 <= target < numNodes) or source == target:
+                raise ValueError("invalid link: {} -> {}".format(source, target))
+            offsets[source + 1] += 1
+        for u in range(numNodes):
+            offsets[u + 1] += offsets[u]
+        return Topology(numNodes, offsets, [link[1] for link in links], [link[2] for link in links])
+
+    #
+    # Creates a tree from the parent of each node (None for the sinks) and the PRR of its link.
+    #
+    @staticmethod
+    def fromParents(parents, prrlist):
+        return Topology.fromLinks(len(parents), [(u, parents[u], prrlist[u])
+                                                 for u in range(len(parents)) if parents[u] is not None])
+
+    def numLinks(self):
+        return len(self.targets)
+
+    def links(self, u):
+        return range(self.offsets[u], self.offsets[u + 1])
+
+    def isSink(self, u):
+        return self.offsets[u] == self.offsets[u + 1]
+
+    #
+    # The nodes ordered so that each node comes before its next hops (leaves first).
+    #
+    def topologicalOrder(self):
+        children = [0] * self.numNodes
+        for v in self.targets:
+            children[v] += 1
+        order = [u for u in range(self.numNodes) if children[u] == 0]
+        i = 0
+        while i < len(order):
+            u = order[i]
+            i += 1
+            for k in self.links(u):
+                v = self.targets[k]
+                children[v] -= 1
+                if children[v] == 0:
+                    order.append(v)
+        if len(order) != self.numNodes:
+            raise ValueError("the topology has a cycle")
+        return order
+
+    #
+    # The number of hops from each node to the nearest sink.
+    #
+    def depth(self):
+        depth = [0] * self.numNodes
+        for u in reversed(self.order):
+            if not self.isSink(u):
+                depth[u] = 1 + min(depth[self.targets[k]] for k in self.links(u))
+        return depth
+
+    #
+    # The packets per slotframe each node sends: its own and the forwarded ones,
+    # with the traffic of a node split evenly between its next hops.
+    #
+    def forwardingLoad(self, packetsPerNode):
+        load = [float(n) for n in packetsPerNode]
+        for u in self.order:
+            if not self.isSink(u):
+                share = load[u] / (self.offsets[u + 1] - self.offsets[u])
+                for k in self.links(u):
+                    load[self.targets[k]] += share
+        return load
+
+#
+# A random tree rooted at node 0, with at most `maxChildren` children per node.
+#
+def randomTree(numNodes, maxChildren = 4, minPrr = 0.7, maxPrr = 1.0):
+    return randomDag(numNodes, 1, maxChildren, minPrr, maxPrr)
+
+#
+# A random DAG with the sink 0, in which each node has up to `numParents` next hops.
+# The first parent of a node has less than `maxChildren` children; the other ones are
+# any nodes created before it, which guarantees that there are no cycles.
+#
+def randomDag(numNodes, numParents = 2, maxChildren = 4, minPrr = 0.7, maxPrr = 1.0):
+    links = []
+    candidates = [0] # the nodes that can have more children
+    children = [0] * numNodes
+    for u in range(1, numNodes):
+        i = random.randrange(len(candidates))
+        parents = [candidates[i]]
+        children[candidates[i]] += 1
+        if children[candidates[i]] >= maxChildren:
+            candidates[i] = candidates[-1]
+            candidates.pop()
+        while len(parents) < min(numParents, u):
+            v = random.randrange(u)
+            if v not in parents:
+                parents.append(v)
+        for v in parents:
+            links.append((u, v, random.uniform(minPrr, maxPrr)))
+        candidates.append(u)
+    return Topology.fromLinks(numNodes, links)
+
+######################################
+
+class Schedule:
+    #
+    # `cells` is a list of (slot, channel, link) tuples.
+    #
+    def __init__(self, cells, slotframeSize = None):
+        if slotframeSize is None:
+            slotframeSize = sim.SLOTFRAME_SIZE
+        cells = sorted(cells)
+        self.slotframeSize = slotframeSize
+        self.offsets = array('l', [0] * (slotframeSize + 1))
+        for slot, channel, link in cells:
+            self.offsets[slot + 1] += 1
+        for s in range(slotframeSize):
+            self.offsets[s + 1] += self.offsets[s]
+        self.channels = array('l', [cell[1] for cell in cells])
+        self.links = array('l', [cell[2] for cell in cells])
+
+    def __len__(self):
+        return len(self.links)
+
+    def cells(self, slot):
+        return [(self.channels[c], self.links[c]) for c in range(self.offsets[slot], self.offsets[slot + 1])]
+
+#
+# The number of cells of each link: enough for its forwarding load, divided by
+# the PRR of the link and multiplied by `overprovision`, and at least one.
+#
+def linkCells(topology, packetsPerNode, overprovision = 1.0):
+    load = topology.forwardingLoad(packetsPerNode)
+    numCells = [0] * topology.numLinks()
+    for u in topology.order:
+        if topology.isSink(u) or load[u] <= 0:
+            continue
+        share = load[u] / (topology.offsets[u + 1] - topology.offsets[u])
+        for k in topology.links(u):
+            numCells[k] = int(math.ceil(share * overprovision / topology.prr[k]))
+    return numCells
+
+#
+# The smallest slotframe that can hold the cells of `linkCells()`: each node needs
+# a timeslot for each of its cells, sending or receiving, and each timeslot holds
+# `numChannels` cells. For trees a schedule of this size always exists.
+#
+def requiredSlotframeSize(topology, packetsPerNode, numChannels = 1, overprovision = 1.0):
+    numCells = linkCells(topology, packetsPerNode, overprovision)
+    degree = [0] * topology.numNodes
+    for k in range(topology.numLinks()):
+        degree[topology.sources[k]] += numCells[k]
+        degree[topology.targets[k]] += numCells[k]
+    return max(max(degree), (sum(numCells) + numChannels - 1) // numChannels)
+
+#
+# Builds a schedule with the cells of `linkCells()`. The cells are allocated
+# from the leaves towards the sinks and spread evenly over the slotframe, the
+# first one after the cells that bring packets to the sender. Each cell goes to
+# the first timeslot from there in which neither the sender nor the receiver
+# has another cell and one of `numChannels` channels is free.
+#
+# If this does not fit all cells, they are placed with `colorCells()` instead,
+# which finds a schedule whenever one exists for a tree, but without the order
+# along the paths.
+#
+def buildSchedule(topology, packetsPerNode, numChannels = 1, overprovision = 1.0):
+    size = sim.SLOTFRAME_SIZE
+    required = requiredSlotframeSize(topology, packetsPerNode, numChannels, overprovision)
+    if required > size:
+        raise ValueError("the cells need a slotframe of at least {} timeslots, not {}".format(required, size))
+    numCells = linkCells(topology, packetsPerNode, overprovision)
+    busy = [set() for _ in range(size)] # the nodes with a cell in each timeslot
+    ready = [0] * topology.numNodes # the timeslot after the last cell towards each node
+    cells = []
+    for u in topology.order:
+        for k in topology.links(u):
+            v = topology.targets[k]
+            for i in range(numCells[k]):
+                # spread the cells of the link evenly over the slotframe
+                first = ready[u] + i * size // numCells[k]
+                for d in range(size):
+                    s = (first + d) % size
+                    if len(busy[s]) < 2 * numChannels and u not in busy[s] and v not in busy[s]:
+                        break
+                else:
+                    return Schedule(colorCells(topology, numCells, size, numChannels), size)
+                cells.append((s, len(busy[s]) // 2, k))
+                busy[s].update((u, v))
+                if i == 0 and s >= ready[u]:
+                    ready[v] = max(ready[v], s + 1)
+    return Schedule(cells, size)
+
+#
+# Places the cells as an edge coloring of the multigraph with an edge per cell,
+# with the timeslots as colors, and returns them as (slot, channel, link) tuples.
+#
+# An edge gets a timeslot free at both of its nodes; if there is none, a
+# timeslot `a` free at the sender and `b` free at the receiver are swapped along
+# the path of a- and b-edges from the receiver (Konig's method), which frees `a`
+# at the receiver in a bipartite graph. Then the timeslots with more than
+# `numChannels` cells are balanced against the ones with fewer by swapping the
+# two timeslots on a path with more edges in the full one (de Werra's method).
+#
+def colorCells(topology, numCells, size, numChannels):
+    edges = []
+    for k in range(topology.numLinks()):
+        for i in range(numCells[k]):
+            edges.append((topology.sources[k], topology.targets[k], k))
+    slotOf = [None] * len(edges)
+    at = [dict() for _ in range(topology.numNodes)] # timeslot -> edge, for each node
+    count = [0] * size
+
+    def setSlot(e, s):
+        slotOf[e] = s
+        at[edges[e][0]][s] = e
+        at[edges[e][1]][s] = e
+        count[s] += 1
+
+    def clearSlot(e):
+        s = slotOf[e]
+        del at[edges[e][0]][s]
+        del at[edges[e][1]][s]
+        count[s] -= 1
+
+    def other(e, x):
+        return edges[e][1] if edges[e][0] == x else edges[e][0]
+
+    # the edges of the a/b path that leaves `x` on an `a` edge, up to the edge `stop`, and its last node
+    def path(x, a, b, stop = None):
+        result = []
+        while a in at[x]:
+            e = at[x][a]
+            if e == stop:
+                break
+            result.append(e)
+            x = other(e, x)
+            a, b = b, a
+        return result, x
+
+    # exchanges the timeslots `a` and `b` of the edges
+    def swap(chain, a, b):
+        old = [slotOf[e] for e in chain]
+        for e in chain:
+            clearSlot(e)
+        for e, s in zip(chain, old):
+            setSlot(e, b if s == a else a)
+
+    for e in range(len(edges)):
+        u, v, k = edges[e]
+        start = e * size // len(edges)
+        a = next((start + d) % size for d in range(size) if (start + d) % size not in at[u])
+        b = next((start + d) % size for d in range(size) if (start + d) % size not in at[v])
+        if a not in at[v]:
+            setSlot(e, a)
+            continue
+        if b not in at[u]:
+            setSlot(e, b)
+            continue
+        chain, end = path(v, a, b)
+        if end == u:
+            raise ValueError("could not place the cells of node {} in the slotframe".format(u))
+        swap(chain, a, b)
+        setSlot(e, a)
+
+    while max(count) > numChannels:
+        a = count.index(max(count))
+        b = count.index(min(count))
+        for e in range(len(edges)):
+            if slotOf[e] != a:
+                continue
+            # the a/b component of the edge: a path or an even cycle
+            before, x = path(edges[e][0], b, a, e)
+            if x == edges[e][1]:
+                continue # a cycle has as many a- as b-edges
+            after, y = path(edges[e][1], b, a, e)
+            chain = before + [e] + after
+            if sum(1 for f in chain if slotOf[f] == a) > sum(1 for f in chain if slotOf[f] == b):
+                swap(chain, a, b)
+                break
+        else:
+            raise ValueError("could not balance the cells over the channels")
+
+    cells = []
+    channel = [0] * size
+    for e in range(len(edges)):
+        s = slotOf[e]
+        cells.append((s, channel[s], edges[e][2]))
+        channel[s] += 1
+    return cells
+
+######################################
+
+#
+# A node of the network, holding the queue of the packets it sends and the
+# number of its own packets delivered to and lost before a sink.
+# The packets are lists [source node, transmissions on the current hop].
+# Like a `sim.Gw` for the telemetry, `aslot` is the number of cells in which the
+# node sends; there is no adaptive scheduling, so `u` stays 0.
+#
+class Node:
+    def __init__(self, id, isSink, aslot = 0):
+        self.id = id
+        self.isSink = isSink
+        self.queue = deque()
+        self.numOkPackets = 0
+        self.numLostPackets = 0
+        self.u = 0
+        self.aslot = aslot
+
+    def scheduleNewPacket(self, asn):
+        if self.isSink:
+            self.numOkPackets += 1
+        elif len(self.queue) >= sim.MAX_QUEUE:
+            self.numLostPackets += 1
+        else:
+            self.queue.append([self.id, 0])
+
+class MultihopSimulation(sim.Simulation):
+    def __init__(self, stats, nodes, schedule, traffic, topology):
+        sim.Simulation.__init__(self, stats, nodes, schedule, traffic, 0.0, sim.ALGORITHM_CONTIKI, 0, False)
+        self.topology = topology
+
+    def simulateSlot(self, asn):
+        stats = self.stats
+        nodes = self.gws
+        schedule = self.slotframe
+        self.traffic.scheduleArrivals(asn, nodes)
+
+        si = asn % sim.SLOTFRAME_SIZE
+        start = schedule.offsets[si]
+        end = schedule.offsets[si + 1]
+        if start == end:
+            stats.sleeping += 1
+            return
+
+        topology = self.topology
+        sources = topology.sources
+        targets = topology.targets
+
+        # select the transmissions, at most one per node
+        senders = set()
+        receptions = {} # receiver -> the channel it listens on and the links sending on it
+        for c in range(start, end):
+            link = schedule.links[c]
+            u = sources[link]
+            if not nodes[u].queue or u in senders:
+                stats.idlelistening += 1
+                continue
+            senders.add(u)
+            v = targets[link]
+            channel = schedule.channels[c]
+            if v not in receptions:
+                receptions[v] = (channel, [link])
+            elif receptions[v][0] == channel:
+                receptions[v][1].append(link)
+            else:
+                # the receiver listens on another channel
+                self.failed(link)
+                stats.collisionsTx += 1
+
+        for v, (channel, links) in receptions.items():
+            if len(links) > 1:
+                for link in links:
+                    self.failed(link)
+                    stats.collisionsTx += 1
+                stats.collisionsRx += 1
+                continue
+            link = links[0]
+            stats.txrx += 1
+            if v in senders or random.random() >= topology.prr[link]:
+                # the receiver was sending, or the packet was not received
+                self.failed(link)
+                continue
+            receiver = nodes[v]
+            sender = nodes[sources[link]]
+            if receiver.isSink:
+                packet = sender.queue.popleft()
+                nodes[packet[0]].numOkPackets += 1
+            elif len(receiver.queue) >= sim.MAX_QUEUE:
+                # no space, no acknowledgement
+                self.failed(link)
+            else:
+                packet = sender.queue.popleft()
+                packet[1] = 0
+                receiver.queue.append(packet)
+
+    #
+    # A failed transmission of the packet at the head of the queue of the sender of `link`.
+    #
+    def failed(self, link):
+        queue = self.gws[self.topology.sources[link]].queue
+        packet = queue[0]
+        packet[1] += 1
+        if packet[1] >= sim.NUM_TX:
+            queue.popleft()
+            self.gws[packet[0]].numLostPackets += 1
+
+#
+# Simulates a multihop network. `packetsPerNode` is the traffic generated by each node.
+# Without a `schedule`, one is built with `buildSchedule()`. The default periodic
+# traffic needs a whole number of packets per slotframe; for fractional rates, pass
+# `trafficSources`, e.g. `traffic.poissonSources()`.
+#
+def simulateMultihop(stats, topology, packetsPerNode, schedule = None, numChannels = 1,
+                     trafficSources = None):
+    if len(packetsPerNode) != topology.numNodes:
+        raise ValueError("the traffic of {} nodes given for {} nodes".format(len(packetsPerNode), topology.numNodes))
+    if trafficSources is None:
+        for n in packetsPerNode:
+            if n != int(n):
+                raise ValueError("periodic traffic needs whole packets per slotframe, not {}; "
+                                 "pass trafficSources for fractional rates".format(n))
+    if schedule is None:
+        schedule = buildSchedule(topology, packetsPerNode, numChannels)
+    traffic = sim.getTraffic(packetsPerNode, trafficSources)
+    aslot = [0] * topology.numNodes
+    for link in schedule.links:
+        aslot[topology.sources[link]] += 1
+    nodes = [Node(u, topology.isSink(u), aslot[u]) for u in range(topology.numNodes)]
+
+    simulation = MultihopSimulation(stats, nodes, schedule, traffic, topology)
+    simulation.run()
+    simulation.finish()
+    return simulation
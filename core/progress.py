@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Progress and throughput metrics of long simulations and sweeps.
+#
+# A Progress meter counts the simulated slots and the completed jobs, and
+# every `interval` seconds reports the progress, the estimated time to
+# completion, the simulated slots per second and the utilisation of each
+# worker process. The report is written as a compact status line and,
+# optionally, as a Prometheus textfile (e.g. for the textfile collector of
+# the node exporter), which is rewritten atomically.
+#
+# Usage, within a run:
+#
+#    stats.progress = progress.Progress(totalSlots = sim.NUM_SLOTFRAMES * sim.SLOTFRAME_SIZE)
+#    sim.simulateDedicated(stats, ...)
+#
+# and for a sweep of jobs (see jobs.py):
+#
+#    meter = progress.Progress(totalJobs = len(jobList), textfile = "/var/lib/node_exporter/tsch.prom")
+#    for result in jobs.runJobs(jobList, progress = meter):
+#        ...
+#    meter.close()
+#
+
+import sys, os, time
+
+PREFIX = "tsch_sim"
+
+######################################
+
+def formatDuration(seconds):
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    return "{}:{:02}:{:02}".format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+def formatRate(rate):
+    for unit, scale in (("G", 1e9), ("M", 1e6), ("k", 1e3)):
+        if rate >= scale:
+            return "{:.1f}{}".format(rate / scale, unit)
+    return "{:.0f}".format(rate)
+
+class Progress:
+    def __init__(self, totalJobs = None, totalSlots = None, textfile = None, interval = 5.0,
+                 stream = sys.stderr, name = PREFIX):
+        self.totalJobs = totalJobs
+        self.totalSlots = totalSlots
+        self.textfile = textfile
+        self.interval = interval
+        self.stream = stream
+        self.name = name
+        self.startTime = time.time()
+        self.jobs = 0
+        self.failed = 0
+        self.slots = 0
+        self.rate = 0.0
+        self.lastTime = self.startTime
+        self.lastSlots = 0
+        self.lineLength = 0
+        # per-worker busy time, number of jobs and end of the last job
+        self.busy = {}
+        self.workerJobs = {}
+        self.lastEnd = {}
+
+    # the output stream cannot be pickled (see sim.Simulation.snapshot)
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["stream"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.stream = sys.stderr
+
+    def addJobs(self, n):
+        self.totalJobs = (self.totalJobs or 0) + n
+
+    #
+    # Called by the simulator at the end of each slotframe.
+    #
+    def slotframeEnd(self, slots):
+        self.slots += slots
+        self.update()
+
+    #
+    # Counts a completed job. The result of a job from jobs.py also
+    # gives its simulated slots and the worker that ran it.
+    #
+    def jobDone(self, result = None):
+        self.jobs += 1
+        if result is not None:
+            if "error" in result:
+                self.failed += 1
+            self.slots += result.get("slots", 0)
+            worker = result.get("worker")
+            if worker is not None:
+                self.busy[worker] = self.busy.get(worker, 0.0) + result["time"]
+                self.workerJobs[worker] = self.workerJobs.get(worker, 0) + 1
+                self.lastEnd[worker] = max(self.lastEnd.get(worker, 0.0), result["start"] + result["time"])
+        self.update()
+
+    def update(self):
+        now = time.time()
+        if now - self.lastTime >= self.interval:
+            self.report(now)
+
+    ######################################
+
+    def elapsed(self, now = None):
+        return (now or time.time()) - self.startTime
+
+    #
+    # The fraction of the work done, by slots if the total is known, else by jobs.
+    #
+    def fraction(self):
+        if self.totalSlots:
+            return min(1.0, float(self.slots) / self.totalSlots)
+        if self.totalJobs:
+            return min(1.0, float(self.jobs) / self.totalJobs)
+        return None
+
+    def eta(self, now = None):
+        fraction = self.fraction()
+        if not fraction:
+            return None
+        return self.elapsed(now) * (1.0 - fraction) / fraction
+
+    #
+    # The fraction of the time since the start that each worker spent running jobs.
+    #
+    def utilisation(self, now = None):
+        elapsed = max(self.elapsed(now), 1e-9)
+        return dict((worker, min(1.0, busy / elapsed)) for worker, busy in self.busy.items())
+
+    def report(self, now = None):
+        now = now or time.time()
+        if now > self.lastTime:
+            self.rate = (self.slots - self.lastSlots) / (now - self.lastTime)
+        self.lastTime = now
+        self.lastSlots = self.slots
+        if self.stream is not None:
+            line = self.statusLine(now)
+            # pad the line to overwrite the previous one
+            self.stream.write("\r" + line.ljust(self.lineLength))
+            self.lineLength = len(line)
+            self.stream.flush()
+        if self.textfile is not None:
+            self.writeTextfile(now)
+
+    def statusLine(self, now = None):
+        fraction = self.fraction()
+        parts = ["{:5.1f}%".format(100.0 * fraction) if fraction is not None else "  ?  %"]
+        if self.totalJobs:
+            parts.append("{}/{} jobs".format(self.jobs, self.totalJobs))
+        elif self.jobs:
+            parts.append("{} jobs".format(self.jobs))
+        if self.failed:
+            parts.append("{} failed".format(self.failed))
+        parts.append("{} slots/s".format(formatRate(self.rate)))
+        parts.append("elapsed {}".format(formatDuration(self.elapsed(now))))
+        parts.append("ETA {}".format(formatDuration(self.eta(now))))
+        utilisation = self.utilisation(now)
+        if utilisation:
+            parts.append("{} workers {:.0f}% busy".format(
+                len(utilisation), 100.0 * sum(utilisation.values()) / len(utilisation)))
+        return "  ".join(parts)
+
+    #
+    # The metrics in the Prometheus text exposition format.
+    #
+    def metrics(self, now = None):
+        now = now or time.time()
+        name = self.name
+        lines = []
+        def metric(metricName, kind, help, samples):
+            lines.append("# HELP {}_{} {}".format(name, metricName, help))
+            lines.append("# TYPE {}_{} {}".format(name, metricName, kind))
+            for labels, value in samples:
+                lines.append("{}_{}{} {}".format(name, metricName, labels, float(value)))
+        metric("slots", "counter", "Simulated timeslots.", [("", self.slots)])
+        metric("jobs_done", "counter", "Completed simulation jobs.", [("", self.jobs)])
+        metric("jobs_failed", "counter", "Failed simulation jobs.", [("", self.failed)])
+        if self.totalJobs is not None:
+            metric("jobs_total", "gauge", "Simulation jobs in the sweep.", [("", self.totalJobs)])
+        metric("slots_per_second", "gauge", "Simulated timeslots per second since the last report.",
+               [("", self.rate)])
+        metric("elapsed_seconds", "gauge", "Time since the start.", [("", self.elapsed(now))])
+        fraction = self.fraction()
+        if fraction is not None:
+            metric("progress_ratio", "gauge", "Fraction of the work done.", [("", fraction)])
+        eta = self.eta(now)
+        if eta is not None:
+            metric("eta_seconds", "gauge", "Estimated time to completion.", [("", eta)])
+        workers = sorted(self.busy)
+        if workers:
+            utilisation = self.utilisation(now)
+            metric("worker_utilisation_ratio", "gauge", "Fraction of the time a worker spent running jobs.",
+                   [('{{worker="{}"}}'.format(w), utilisation[w]) for w in workers])
+            metric("worker_jobs", "counter", "Jobs completed by a worker.",
+                   [('{{worker="{}"}}'.format(w), self.workerJobs[w]) for w in workers])
+            metric("worker_idle_seconds", "gauge", "Time since a worker completed its last job.",
+                   [('{{worker="{}"}}'.format(w), max(0.0, now - self.lastEnd[w])) for w in workers])
+        return "\n".join(lines) + "\n"
+
+    #
+    # Rewrites the textfile; the rename is atomic, so readers never see a partial file.
+    #
+    def writeTextfile(self, now = None):
+        temp = "{}.{}.tmp".format(self.textfile, os.getpid())
+        with open(temp, "w") as f:
+            f.write(self.metrics(now))
+        os.rename(temp, self.textfile)
+
+    #
+    # Writes the final report and ends the status line.
+    #
+    def close(self):
+        self.report()
+        if self.stream is not None:
+            self.stream.write("\n")
+            self.stream.flush()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Selection of the best configuration with successive halving.
+#
+# Instead of simulating every candidate configuration at full length, all
+# candidates are first simulated with short runs. After each round, the
+# candidates whose confidence interval lies entirely below the interval of the
+# current best are dropped, and of the rest only the best 1/eta are kept.
+# The survivors are simulated with eta times longer runs in the next round,
+# so most of the budget is spent on the candidates that are still in contention.
+#
+# Usage:
+#
+#    winner, pdr, stderr = selection.selectSharedSlots([14] * 4, prrlist, 0.7,
+#                                                     sim.ALGORITHM_CONTIKI, 80)
+#
+
+import math
+
+import sim
+
+######################################
+
+class Candidate:
+    def __init__(self, config):
+        self.config = config
+        self.values = []
+        self.lengths = []
+
+    #
+    # Mean of the results, weighting each run by its length in slotframes.
+    #
+    def mean(self):
+        total = float(sum(self.lengths))
+        return sum(v * l for v, l in zip(self.values, self.lengths)) / total
+
+    #
+    # Standard error of `mean()`, assuming that the variance of a run's result
+    # is inversely proportional to its length.
+    #
+    def stderr(self):
+        n = len(self.values)
+        if n < 2:
+            return float("inf")
+        m = self.mean()
+        sigma2 = sum(l * (v - m) ** 2 for v, l in zip(self.values, self.lengths)) / (n - 1)
+        return math.sqrt(sigma2 / sum(self.lengths))
+
+#
+# Selects the configuration with the highest `evaluate(config)` result.
+#
+# `evaluate` runs a single simulation with the current sim.NUM_SLOTFRAMES and
+# returns the result to maximize. Each round runs every remaining candidate
+# `repeat` times; the run length starts at `initialSlotframes` and grows
+# by `eta` in each round. The selection stops when one candidate is left, after
+# `maxSlotframes` per run is reached, or when the total `budget` of simulated
+# slotframes would be exceeded. `z` sets the width of the confidence intervals.
+#
+# Returns the best configuration, its estimated result and the standard error.
+#
+def selectBest(configs, evaluate, initialSlotframes = 10, maxSlotframes = None, eta = 2,
+               repeat = 3, budget = None, z = 2.0):
+    if maxSlotframes is None:
+        maxSlotframes = sim.NUM_SLOTFRAMES
+    candidates = [Candidate(config) for config in configs]
+    oldNumSlotframes = sim.NUM_SLOTFRAMES
+    used = 0
+    length = min(initialSlotframes, maxSlotframes)
+    try:
+        while True:
+            cost = length * repeat * len(candidates)
+            if budget is not None and used + cost > budget and used > 0:
+                break
+            sim.NUM_SLOTFRAMES = length
+            for c in candidates:
+                for r in range(repeat):
+                    c.values.append(evaluate(c.config))
+                    c.lengths.append(length)
+            used += cost
+
+            # drop the candidates that are clearly worse than the best one
+            candidates.sort(key = lambda c: -c.mean())
+            best = candidates[0]
+            bound = best.mean() - z * best.stderr()
+            candidates = [c for c in candidates if c.mean() + z * c.stderr() >= bound]
+            if len(candidates) == 1 or length >= maxSlotframes:
+                break
+
+            # keep the best 1/eta of the rest
+            candidates = candidates[:max(1, int(math.ceil(len(candidates) / float(eta))))]
+            length = min(length * eta, maxSlotframes)
+    finally:
+        sim.NUM_SLOTFRAMES = oldNumSlotframes
+
+    best = max(candidates, key = lambda c: c.mean())
+    return best.config, best.mean(), best.stderr()
+
+#
+# Selects the number of shared slots out of `totalSlots` that gives the best PDR.
+# By default all numbers of shared slots from 0 to `totalSlots` are considered.
+#
+def selectSharedSlots(packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots,
+                      candidates = None, **kwargs):
+    if candidates is None:
+        candidates = list(range(totalSlots + 1))
+        if totalSlots < len(packetsPerGw):
+            # no dedicated-only configuration possible
+            candidates.remove(0)
+
+    def evaluate(sharedSlots):
+        stats = sim.Statistics(packetsPerGw)
+        sim.simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots)
+        return stats.pdr
+
+    return selectBest(candidates, evaluate, **kwargs)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Sensitivities of the PDR and the energy from a single run.
+#
+# The derivatives are estimated with the likelihood ratio (score function)
+# method. Each random decision of the simulator that depends on a parameter
+# adds the derivative of the log of its probability to the score of the
+# parameter; the derivative of an expected value is then the expected value
+# times the score. The parameters are:
+#
+#  * the PRR of each gateway: a transmission with success probability p adds
+#    1/p if it succeeds and -1/(1-p) if it fails. With a time-varying link
+#    (see link.py), this is the derivative with respect to a shift of the PRR
+#    at all times.
+#  * the contention in shared slots, as a factor c multiplying the probability
+#    p of each gateway to transmit in a shared slot, at c = 1: transmitting
+#    adds 1, not transmitting adds -p/(1-p).
+#
+# The run is split into regeneration cycles (see importance.py), so that the
+# scores stay bounded: the PDR of each gateway is the ratio of its delivered
+# and generated packets per cycle, and the energy per slot the ratio of the
+# energy and the length of a cycle. The derivative of a ratio E[Y] / E[X] is
+# (E[Y S] - r E[X S]) / E[X] for the cycle score S; the standard errors come
+# from the delta method. The cycles cut by the reset of the counters after
+# the warm-up are skipped.
+#
+# Usage:
+#
+#    stats = sim.Statistics(packetsPerGw)
+#    stats.sampler = sensitivity.SensitivityEstimator()
+#    sim.simulatePartial(stats, ...)
+#    print(stats.sampler.pdr(), stats.sampler.pdrGradient())
+#
+# Running this file checks the estimates against finite differences.
+#
+
+import sys, math
+
+import sim
+from importance import RegenerativeEstimator
+
+######################################
+
+#
+# Estimates sum(y) / sum(x) and its derivative with the cycle scores `s`.
+# Returns the ratio, the derivative and the influence of each cycle on the derivative.
+#
+def ratioGradient(y, x, s):
+    n = len(y)
+    mx = sum(x) / float(n)
+    r = sum(y) / float(sum(x))
+    b = sum(x[c] * s[c] for c in range(n)) / n
+    g = (sum(y[c] * s[c] for c in range(n)) / n - r * b) / mx
+    influence = [(y[c] * s[c] - r * x[c] * s[c] - (b / mx) * (y[c] - r * x[c]) - g * x[c]) / mx
+                 for c in range(n)]
+    return r, g, influence
+
+#
+# The standard error of a mean from the influence of each sample.
+#
+def stderr(influence):
+    n = len(influence)
+    if n < 2:
+        return None
+    m = sum(influence) / n
+    var = sum((v - m) ** 2 for v in influence) / (n - 1)
+    return math.sqrt(var / n)
+
+######################################
+
+class SensitivityEstimator(RegenerativeEstimator):
+    def __init__(self, pilotSlotframes = 10):
+        RegenerativeEstimator.__init__(self, pilotSlotframes)
+        self.numGws = 0
+        # the scores of the current cycle: one per gateway PRR, then the contention
+        self.score = None
+        self.slots = 0
+        self.start = None
+        # per cycle: delivered and generated packets of each gateway, the scores,
+        # the energy and the length in slots
+        self.cycleDelivered = []
+        self.cycleGenerated = []
+        self.cycleScores = []
+        self.cycleEnergy = []
+        self.cycleLength = []
+
+    def linkOk(self, r, p, packet):
+        ok = r <= p
+        if self.score is not None:
+            if ok:
+                self.score[packet.gw.id] += 1.0 / p
+            else:
+                self.score[packet.gw.id] -= 1.0 / (1.0 - p)
+        return ok
+
+    def transmitOk(self, r, p, gw):
+        ok = r <= p
+        if self.score is not None and p < 1.0:
+            if ok:
+                self.score[-1] += 1.0
+            else:
+                self.score[-1] -= p / (1.0 - p)
+        return ok
+
+    def slotEnd(self, slotIndex, stats, gws):
+        self.slots += 1
+        self.numGws = len(gws)
+        RegenerativeEstimator.slotEnd(self, slotIndex, stats, gws)
+
+    def startCycle(self, stats, gws):
+        self.numGws = len(gws)
+        self.score = [0.0] * (self.numGws + 1)
+        self.start = ([gw.numOkPackets for gw in gws], [gw.numOkPackets + gw.numLostPackets for gw in gws],
+                      stats.energy(), self.slots)
+
+    def endCycle(self, stats, gws):
+        ok, total, energy, slots = self.start
+        delivered = [gws[i].numOkPackets - ok[i] for i in range(self.numGws)]
+        generated = [gws[i].numOkPackets + gws[i].numLostPackets - total[i] for i in range(self.numGws)]
+        if min(delivered) < 0 or min(generated) < 0:
+            # the counters were reset during the cycle
+            return
+        self.cycleDelivered.append(delivered)
+        self.cycleGenerated.append(generated)
+        self.cycleScores.append(self.score)
+        self.cycleEnergy.append(stats.energy() - energy)
+        self.cycleLength.append(self.slots - slots)
+
+    def numCycles(self):
+        return len(self.cycleScores)
+
+    ######################################
+
+    #
+    # The PDR in percent, averaged over the gateways like `Statistics.pdr`,
+    # and its derivatives (with their standard errors) with respect to each
+    # of the parameters: the PRR of each gateway, then the contention.
+    #
+    def pdrEstimates(self):
+        n = self.numCycles()
+        if n < 2:
+            return None, [(None, None)] * (self.numGws + 1)
+        gwIds = [i for i in range(self.numGws) if sum(g[i] for g in self.cycleGenerated)]
+        scale = 100.0 / len(gwIds)
+        pdr = 0.0
+        result = []
+        for k in range(self.numGws + 1):
+            s = [score[k] for score in self.cycleScores]
+            gradient = 0.0
+            influence = [0.0] * n
+            for i in gwIds:
+                r, g, inf = ratioGradient([d[i] for d in self.cycleDelivered],
+                                          [g[i] for g in self.cycleGenerated], s)
+                if k == 0:
+                    pdr += scale * r
+                gradient += scale * g
+                for c in range(n):
+                    influence[c] += scale * inf[c]
+            result.append((gradient, stderr(influence)))
+        return pdr, result
+
+    def pdr(self):
+        return self.pdrEstimates()[0]
+
+    #
+    # The derivatives of the PDR with respect to the PRR of each gateway, in percent
+    # per unit of PRR, as (value, standard error) tuples.
+    #
+    def pdrGradient(self):
+        return self.pdrEstimates()[1][:-1]
+
+    #
+    # The derivative of the PDR with respect to the contention factor in shared slots.
+    #
+    def pdrContention(self):
+        return self.pdrEstimates()[1][-1]
+
+    #
+    # The energy of a run of NUM_SLOTFRAMES slotframes in J, like `Statistics.energy()`,
+    # and its derivatives with respect to the parameters (see `pdrEstimates()`).
+    #
+    def energyEstimates(self):
+        n = self.numCycles()
+        if n < 2:
+            return None, [(None, None)] * (self.numGws + 1)
+        slots = sim.NUM_SLOTFRAMES * sim.SLOTFRAME_SIZE
+        result = []
+        for k in range(self.numGws + 1):
+            rate, g, influence = ratioGradient(self.cycleEnergy, self.cycleLength,
+                                               [score[k] for score in self.cycleScores])
+            result.append((slots * g, slots * stderr(influence)))
+        return slots * rate, result
+
+    def energyGradient(self):
+        return self.energyEstimates()[1][:-1]
+
+    def energyContention(self):
+        return self.energyEstimates()[1][-1]
+
+######################################
+
+#
+# Compares the estimates of a single run with central finite differences over
+# repeated runs with common seeds, for two gateways with dedicated slots.
+#
+def main():
+    import random
+    packetsPerGw = [2, 2]
+    prrlist = [0.5, 0.7]
+    h = 0.05
+    sim.NUM_SLOTFRAMES = 20000
+    random.seed(2)
+    stats = sim.Statistics(packetsPerGw)
+    stats.sampler = SensitivityEstimator()
+    sim.simulateDedicated(stats, packetsPerGw, prrlist, False, 4, 0)
+    e = stats.sampler
+    print("{} cycles, PDR {:.3f} (simulated {:.3f})".format(e.numCycles(), e.pdr(), stats.pdr))
+
+    def run(prr, seed):
+        random.seed(seed)
+        s = sim.Statistics(packetsPerGw)
+        sim.simulateDedicated(s, packetsPerGw, prr, False, 4, 0)
+        return s.pdr, s.energy()
+
+    ok = True
+    estimates = [("PDR", e.pdrGradient()), ("energy", e.energyGradient())]
+    for gw in range(len(prrlist)):
+        differences = [[], []]
+        for seed in range(5):
+            low = list(prrlist)
+            high = list(prrlist)
+            low[gw] -= h
+            high[gw] += h
+            a, b = run(low, seed), run(high, seed)
+            for k in range(2):
+                differences[k].append((b[k] - a[k]) / (2 * h))
+        for k in range(2):
+            name, gradient = estimates[k]
+            value, error = gradient[gw]
+            fd = sum(differences[k]) / len(differences[k])
+            fdError = stderr(differences[k])
+            agree = abs(value - fd) <= 3 * math.sqrt(error ** 2 + fdError ** 2)
+            ok = ok and agree
+            print("d{}/dPRR{}: {:.2f} +- {:.2f}, finite differences {:.2f} +- {:.2f}: {}".format(
+                name, gw, value, error, fd, fdError, "agree" if agree else "DIFFER"))
+    print("OK" if ok else "FAILED")
+    return ok
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -26,7 +26,8 @@
 #          Xenofon Fafoutis
 #
 
-import sys, random
+import sys, random, pickle
+import traffic as trafficsources
 
 # Enable CCA? (It's not enabled in Contiki experiments)
 DO_CCA = False
@@ -34,6 +35,9 @@ DO_CCA = False
 # Number of slotframes to simulate
 NUM_SLOTFRAMES = 100
 
+# Number of slotframes to simulate before NUM_SLOTFRAMES, whose results are discarded
+NUM_WARMUP_SLOTFRAMES = 0
+
 # Total slotframe size in slots (99 slots = approximately 1 second)
 SLOTFRAME_SIZE = 100
 
@@ -78,6 +82,14 @@ class Statistics:
         self.gwlist = []
         self.prr = None
         self.tr = None
+        # optional time-series recorder (see telemetry.py)
+        self.telemetry = None
+        # optional importance sampler (see importance.py)
+        self.sampler = None
+        # optional progress meter (see progress.py)
+        self.progress = None
+        # optional per-packet histograms (see histogram.py)
+        self.histograms = None
 
 
     def energy(self):
@@ -142,17 +154,29 @@ class SuperStatistics:
 ######################################
 
 class Packet:
-    def __init__(self, gw):
+    def __init__(self, gw, arrival = 0):
         self.tx = 0
         self.gw = gw
+        self.arrival = arrival # ASN
         self.backoff = 0
         self.more = 0
+        # likelihood ratio of the packet's fate (used by importance.py)
+        self.weight = 1.0
 
-    def send(self):
+    def send(self, asn):
         self.tx += 1
-        ok = random.random() <= self.gw.prr
+        r = random.random()
+        prr = self.gw.prr if self.gw.link is None else self.gw.link.prrAt(asn)
+        if self.gw.sampler is None:
+            ok = r <= prr
+        else:
+            ok = self.gw.sampler.linkOk(r, prr, self)
+            if ok:
+                self.gw.sampler.delivered(self)
         if ok:
             self.gw.numOkPackets += 1
+            if self.gw.histograms is not None:
+                self.gw.histograms.delivered(self, asn)
         return ok
 
     def __repr__(self):
@@ -166,30 +190,42 @@ class Gw:
         self.queue = []
         self.numOkPackets = 0
         self.numLostPackets = 0
-        self.prr = p
+        # `p` is either a constant PRR or a link model (see link.py)
+        if hasattr(p, "prrAt"):
+            self.link = p
+            self.prr = p.meanPrr()
+        else:
+            self.link = None
+            self.prr = p
         self.col = 0
         self.useNextSharedSlot = 0
+        self.sampler = None
+        self.histograms = None
 
         self.aslot = s
         self.aslotmax = s_max
+        # number of cells the gateway can use in the same timeslot (multi-channel slotframes only)
+        self.radios = 1
         self.u = 0.95
         self.alpha = 0.1
 
     def schedulePacket(self, packet):
-        if packet.tx >= NUM_TX:
-            self.numLostPackets += 1
-            return
-        if len(self.queue) >= MAX_QUEUE:
+        if packet.tx >= NUM_TX or len(self.queue) >= MAX_QUEUE:
             self.numLostPackets += 1
+            if self.sampler is not None:
+                self.sampler.lost(packet)
             return
         self.queue.append(packet)
 
-    def scheduleNewPacket(self, slotIndex, traffic):
-        if traffic[self.id][slotIndex] == 1:
-            if len(self.queue) >= MAX_QUEUE:
-                self.numLostPackets += 1
-            else:
-                self.queue.append(Packet(self))
+    def scheduleNewPacket(self, asn):
+        if self.histograms is not None:
+            self.histograms.arrival(len(self.queue))
+        if len(self.queue) >= MAX_QUEUE:
+            self.numLostPackets += 1
+            if self.sampler is not None:
+                self.sampler.overflow(self)
+        else:
+            self.queue.append(Packet(self, asn))
 
     def __repr__(self):
         #print(self.queue)
@@ -244,6 +280,7 @@ def getPacketsContiki(senderSlot, gws, numSharedSlots):
             packets.append(packet)
     else:
         bestgw = None
+        sampler = None
         # shared slot
         for gw in gws:
             #if len(gw.queue) <= 2:
@@ -256,13 +293,19 @@ def getPacketsContiki(senderSlot, gws, numSharedSlots):
                 #C = C**1.5      # use more agressive sending
                 #C = C**2        # use even more agressive sending
                 #print(C  * float(numSharedSlots) / SLOTFRAME_SIZE)
-                ok = r <= (C / float(numSharedSlots))
+                if gw.sampler is None:
+                    ok = r <= (C / float(numSharedSlots))
+                else:
+                    sampler = gw.sampler
+                    ok = sampler.transmitOk(r, C / float(numSharedSlots), gw)
                 if ok:
                     packet = gw.queue[0]
                     gw.queue = gw.queue[1:]
                     packets.append(packet)               
                 #else:
                     #print("backoff")
+        if sampler is not None:
+            sampler.contention(packets)
     return packets
 
 #
@@ -318,6 +361,40 @@ def updateSlotFrame(slotframe, gws, asn, gw):
                 slotframe[i] = INACTIVE
 
 
+#
+# Handles more than one packet sent in the same cell.
+#
+def resolveCollision(stats, packets, ccaSuccessProb, asn):
+    # for 2 packets, it's one check that must succeed, for n packets: n-1 checks
+    if DO_CCA:
+        numChecks = len(packets) - 1
+        if random.random() <= ccaSuccessProb ** numChecks:
+            # cca ok; the one of packets went through, the rest back off
+            okpacket = random.randint(0, len(packets) - 1)
+            for i in range(len(packets)):
+                packet = packets[i]
+                if i == okpacket:
+                    if not packet.send(asn):
+                        # reschedule it
+                        packet.gw.schedulePacket(packet)
+                else:
+                    # reschedule it without increasing Tx count
+                    packet.backoff += 1
+                    packet.gw.schedulePacket(packet)
+        else:
+            # CCA failed to detect concurrent transmissions
+            for packet in packets:
+                packet.tx += 1
+                packet.gw.schedulePacket(packet)
+    else:
+        # no CCA
+        for packet in packets:
+            packet.tx += 1
+            packet.gw.schedulePacket(packet)
+            packet.gw.col += 1
+            stats.collisionsTx += 1
+        stats.collisionsRx += 1
+
 #
 # This simulates the operation of a single TSCH timeslot on all nodes.
 #
@@ -325,8 +402,7 @@ def simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb,
             algorithm, numSharedSlots, adaptive, sharedSlotReserved = None):
 
     si = asn % SLOTFRAME_SIZE
-    for gw in gws:
-        a = gw.scheduleNewPacket(si, traffic)
+    traffic.scheduleArrivals(asn, gws)
 
     # on a shared slot, reset the state
     if algorithm == ALGORITHM_CONTIKI_NEGOTIATED:
@@ -349,7 +425,7 @@ def simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb,
     if len(packets) == 1:
         packet = packets[0]
         packet.gw.u = (1 - packet.gw.alpha) * packet.gw.u + packet.gw.alpha * 1
-        if not packet.send():
+        if not packet.send(asn):
             # reschedule it
             packet.gw.schedulePacket(packet)
         else:
@@ -374,35 +450,7 @@ def simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb,
 
     # More than one packet, a collision unless DO_CCA configured and CCA succeeds
     elif len(packets) > 1:
-        # for 2 packets, it's one check that must succeed, for n packets: n-1 checks
-        if DO_CCA:
-            numChecks = len(packets) - 1
-            if random.random() <= ccaSuccessProb ** numChecks:
-                # cca ok; the one of packets went through, the rest back off
-                okpacket = random.randint(0, len(packets) - 1)
-                for i in range(len(packets)):
-                    packet = packets[i]
-                    if i == okpacket:
-                        if not packet.send():
-                            # reschedule it
-                            packet.gw.schedulePacket(packet)
-                    else:
-                        # reschedule it without increasing Tx count
-                        packet.backoff += 1
-                        packet.gw.schedulePacket(packet)
-            else:
-                # CCA failed to detect concurrent transmissions
-                for packet in packets:
-                    packet.tx += 1
-                    packet.gw.schedulePacket(packet)
-        else:
-            # no CCA
-            for packet in packets:
-                packet.tx += 1
-                packet.gw.schedulePacket(packet)
-                packet.gw.col += 1
-                stats.collisionsTx += 1   
-            stats.collisionsRx += 1
+        resolveCollision(stats, packets, ccaSuccessProb, asn)
 
     # No packets, idle slot
     else:
@@ -419,78 +467,200 @@ def simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb,
 #######################################################
 
 #
-# This generates a list of "packets" distributed across timeslots,
-# depending on the slotframe size and the number of packets per slotframe,
-# passed as `packetsPerGw` parameter.
+# This generates the packet arrivals of all gateways. By default the packets
+# are distributed evenly across timeslots, depending on the slotframe size and
+# the number of packets per slotframe, passed as `packetsPerGw` parameter.
+# Alternatively, a list of traffic sources (one per gateway, see traffic.py)
+# can be passed as `sources`.
 #
-def getTraffic(packetsPerGw):
-    traffic = [[0] * SLOTFRAME_SIZE for _ in range(len(packetsPerGw))]
-    for gw in range(len(packetsPerGw)):
-        skip = SLOTFRAME_SIZE // packetsPerGw[gw]
-        for i in range(packetsPerGw[gw]):
-            traffic[gw][i * skip] = 1 # generate a new packet here
-    return traffic
+def getTraffic(packetsPerGw, sources = None):
+    if sources is None:
+        sources = trafficsources.periodicSources(packetsPerGw, SLOTFRAME_SIZE)
+    return trafficsources.TrafficSchedule(sources)
 
 
 #
-# Simulates an operation with only shared slots (slotted Aloha).
+# Resets the counters after the warm-up; the queues are kept.
 #
-def simulateShared(stats, packetsPerGw, prrlist, ccaSuccessProb, total_shared):
-    slotframe = [INACTIVE] * SLOTFRAME_SIZE
-    traffic = getTraffic(packetsPerGw)
+def resetCounters(stats, gws):
+    stats.sleeping = 0
+    stats.idlelistening = 0
+    stats.txrx = 0
+    stats.collisionsTx = 0
+    stats.collisionsRx = 0
+    for gw in gws:
+        gw.numOkPackets = 0
+        gw.numLostPackets = 0
+    if stats.histograms is not None:
+        stats.histograms.reset()
 
-    gws = []
-    for gw in range(len(packetsPerGw)):
-        gws.append(Gw(gw,prrlist[gw],0,0))
+#
+# The state of a simulation run: the statistics, the gateways with their queues,
+# the slotframe, the traffic, and how far the run has got.
+#
+# The simulate* functions return their Simulation. Its state can be saved with
+# `snapshot()`, together with the state of the random number generator, and
+# restored with `restore()` or `fork()`, e.g. to simulate a warm-up once and
+# continue it with different policies (algorithm, adaptive, slotframe...):
+#
+#    sim.NUM_SLOTFRAMES = 10
+#    snapshot = sim.simulateDedicated(stats, packetsPerGw, prrlist, False, 5, 12).snapshot()
+#    for adaptive, s in zip([True, False], sim.fork(snapshot, 2)):
+#        s.adaptive = adaptive
+#        s.resetCounters()
+#        s.run(100)
+#        s.finish()
+#        print(s.stats.pdr)
+#
+class Simulation:
+    def __init__(self, stats, gws, slotframe, traffic, ccaSuccessProb,
+                 algorithm, numSharedSlots, adaptive):
+        self.stats = stats
+        self.gws = gws
+        self.slotframe = slotframe
+        self.traffic = traffic
+        self.ccaSuccessProb = ccaSuccessProb
+        self.algorithm = algorithm
+        self.numSharedSlots = numSharedSlots
+        self.adaptive = adaptive
+        self.isSharedSlotReserved = None
+        self.warmupSlotframes = NUM_WARMUP_SLOTFRAMES
+        # the next slotframe to simulate and the last simulated ASN
+        self.slotframeIndex = 0
+        self.asn = 0
 
-    sn = 0
-    for slot in range(total_shared):
-        slotframe[sn] = SHARED
-        sn += 1
+    def simulateSlot(self, asn):
+        self.isSharedSlotReserved = simSlot(self.stats, self.gws, asn, self.slotframe, self.traffic,
+                                            self.ccaSuccessProb, self.algorithm, self.numSharedSlots,
+                                            self.adaptive, self.isSharedSlotReserved)
+
+    #
+    # Simulates `numSlotframes` more slotframes; by default, the rest of the
+    # warm-up and NUM_SLOTFRAMES. Returns the ASN of the last simulated timeslot.
+    #
+    def run(self, numSlotframes = None):
+        if numSlotframes is None:
+            numSlotframes = self.warmupSlotframes + NUM_SLOTFRAMES - self.slotframeIndex
+        stats = self.stats
+        gws = self.gws
+        simulateSlot = self.simulateSlot
+        telemetry = stats.telemetry
+        sampler = stats.sampler
+        progress = stats.progress
+        histograms = stats.histograms
+        for gw in gws:
+            gw.sampler = sampler
+            gw.histograms = None if histograms is None else histograms.forGw(gw.id)
+        asn = self.asn
+        for s in range(self.slotframeIndex, self.slotframeIndex + numSlotframes):
+            if s == self.warmupSlotframes and s > 0:
+                resetCounters(stats, gws)
+            for slot in range(SLOTFRAME_SIZE):
+                asn = s * SLOTFRAME_SIZE + slot
+                simulateSlot(asn)
+                if sampler is not None:
+                    sampler.slotEnd(slot, stats, gws)
+            if telemetry is not None:
+                telemetry.slotframeEnd(asn, stats, gws)
+            if progress is not None:
+                progress.slotframeEnd(SLOTFRAME_SIZE)
+            self.slotframeIndex = s + 1
+        self.asn = asn
+        return asn
+
+    def resetCounters(self):
+        resetCounters(self.stats, self.gws)
+
+    #
+    # Stores the results of the run so far in the statistics.
+    #
+    def finish(self):
+        self.stats.gwlist = self.gws
+        self.stats.asn = self.asn + 1
+        self.stats.pdr = calculatePdr(self.gws)
+
+    #
+    # Returns the state of the run and of the random number generator as bytes.
+    #
+    def snapshot(self):
+        return pickle.dumps({"simulation": self, "random": random.getstate()}, 2)
+
+    #
+    # Returns `n` independent copies of the run, see `fork()`.
+    #
+    def fork(self, n):
+        return fork(self.snapshot(), n)
+
+#
+# Restores a simulation from a snapshot, including the state of the random number generator.
+#
+def restore(snapshot):
+    state = pickle.loads(snapshot)
+    random.setstate(state["random"])
+    return state["simulation"]
 
-    for s in range(NUM_SLOTFRAMES):
-        for slot in range(SLOTFRAME_SIZE):
-            asn = s * SLOTFRAME_SIZE + slot
-            simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb, ALGORITHM_CONTIKI, total_shared, False)
+#
+# Yields `n` copies of the simulation from a snapshot. The random number generator is
+# restored before each one, so the continuations run in turn use common random numbers.
+#
+def fork(snapshot, n):
+    for i in range(n):
+        yield restore(snapshot)
 
-    stats.gwlist = gws
-    stats.asn += 1
 
+#
+# Calculates the average PDR of all gateways that had any packets.
+#
+def calculatePdr(gws):
     S = 0
     T = 0
-    for i in range(len(packetsPerGw)):
-        if(gws[i].numOkPackets + gws[i].numLostPackets) > 0:
-            print(gws[i].numLostPackets)
-            S = S + 100.0 * gws[i].numOkPackets / (gws[i].numOkPackets + gws[i].numLostPackets)
-            T = T + 1        
-    stats.pdr = S/T
+    for gw in gws:
+        if(gw.numOkPackets + gw.numLostPackets) > 0:
+            S = S + 100.0 * gw.numOkPackets / (gw.numOkPackets + gw.numLostPackets)
+            T = T + 1
+    return S/T
+
 
 #
-# Simulates an operation with both shared and dedicated (collision free) slots.
+# The slotframes of the simulate* functions. A slotframe holds the owner of each
+# slot: the ID of a gateway for a dedicated slot, SHARED or INACTIVE.
 #
-def simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots):
+
+# `numShared` shared slots at the start of the slotframe
+def sharedSlotframe(numShared):
     slotframe = [INACTIVE] * SLOTFRAME_SIZE
-    traffic = getTraffic(packetsPerGw)       
-    
-    NUM_SHARED_SLOTS_PER_SECOND = sharedSlots
-    NUM_DEDICATED_SLOTS = (totalSlots - sharedSlots) // len(packetsPerGw)
+    for sn in range(numShared):
+        slotframe[sn] = SHARED
+    return slotframe
 
-    gws = []
-    for gw in range(len(packetsPerGw)):
-        gws.append(Gw(gw, prrlist[gw], NUM_DEDICATED_SLOTS, NUM_DEDICATED_SLOTS))
+# `slots` dedicated slots for each gateway at the start of the slotframe, in a random order in each round
+def dedicatedSlotframe(numGws, slots):
+    slotframe = [INACTIVE] * SLOTFRAME_SIZE
+    sn = 0
+    for slot in range(slots):
+        section = list(range(numGws))
+        random.shuffle(section)
+        for gw in section:
+            slotframe[sn] = gw
+            sn += 1
+    return slotframe
 
+# dedicated slots like `dedicatedSlotframe` with the shared slots distributed evenly between them
+def partialSlotframe(numGws, totalSlots, sharedSlots):
+    slotframe = [INACTIVE] * SLOTFRAME_SIZE
+    numDedicated = (totalSlots - sharedSlots) // numGws
     sn = 0
     numss = 0
     ns = 0
-    for slot in range(NUM_DEDICATED_SLOTS):
-        section = list(range(len(packetsPerGw)))
+    for slot in range(numDedicated):
+        section = list(range(numGws))
         random.shuffle(section)
         for gw in section:
             slotframe[sn] = gw
             sn += 1
 
         # distribute the shared slots evenly in the sloframe
-        ns += NUM_SHARED_SLOTS_PER_SECOND / float(NUM_DEDICATED_SLOTS)
+        ns += sharedSlots / float(numDedicated)
         for slot in range(int(ns)):
             if numss < sharedSlots:
                 slotframe[sn] = SHARED
@@ -499,67 +669,286 @@ def simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, tot
         ns -= int(ns)
 
     # pad with the remaining number of shared slots
-    for slot in range(NUM_SHARED_SLOTS_PER_SECOND - NUM_SHARED_SLOTS_PER_SECOND // NUM_DEDICATED_SLOTS * NUM_DEDICATED_SLOTS):
+    for slot in range(sharedSlots - sharedSlots // numDedicated * numDedicated):
         if numss < sharedSlots:
             slotframe[sn] = SHARED
             sn += 1
             numss += 1
+    return slotframe
+
+# the slotframe that `simulateAny()` uses
+def anySlotframe(numGws, totalSlots, sharedSlots):
+    if sharedSlots == 0:
+        return dedicatedSlotframe(numGws, totalSlots // numGws)
+    elif sharedSlots >= totalSlots or (totalSlots - sharedSlots) // numGws == 0:
+        return sharedSlotframe(sharedSlots)
+    else:
+        return partialSlotframe(numGws, totalSlots, sharedSlots)
+
+#
+# Simulates an operation with only shared slots (slotted Aloha).
+#
+def simulateShared(stats, packetsPerGw, prrlist, ccaSuccessProb, total_shared, trafficSources = None):
+    traffic = getTraffic(packetsPerGw, trafficSources)
+
+    gws = []
+    for gw in range(len(packetsPerGw)):
+        gws.append(Gw(gw,prrlist[gw],0,0))
+
+    slotframe = sharedSlotframe(total_shared)
 
-    isSharedSlotReserved = None
-    for s in range(NUM_SLOTFRAMES):
-        for slot in range(SLOTFRAME_SIZE):
-            asn = s * SLOTFRAME_SIZE + slot
-            isSharedSlotReserved = simSlot(stats, gws, asn, slotframe, traffic, ccaSuccessProb,
-                                           algorithm, NUM_SHARED_SLOTS_PER_SECOND, False, isSharedSlotReserved)
+    simulation = Simulation(stats, gws, slotframe, traffic, ccaSuccessProb, ALGORITHM_CONTIKI, total_shared, False)
+    simulation.run()
 
     stats.gwlist = gws
     stats.asn += 1
 
-    S = 0
-    T = 0
-    for i in range(len(packetsPerGw)):
-        if(gws[i].numOkPackets + gws[i].numLostPackets) > 0:
-            S = S + 100.0 * gws[i].numOkPackets / (gws[i].numOkPackets + gws[i].numLostPackets)
-            T = T + 1
-    stats.pdr = S/T
+    for gw in gws:
+        if(gw.numOkPackets + gw.numLostPackets) > 0:
+            print(gw.numLostPackets)
+    stats.pdr = calculatePdr(gws)
+    return simulation
+
+#
+# Simulates an operation with both shared and dedicated (collision free) slots.
+#
+def simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                    trafficSources = None):
+    traffic = getTraffic(packetsPerGw, trafficSources)
+    
+    NUM_SHARED_SLOTS_PER_SECOND = sharedSlots
+    NUM_DEDICATED_SLOTS = (totalSlots - sharedSlots) // len(packetsPerGw)
+
+    gws = []
+    for gw in range(len(packetsPerGw)):
+        gws.append(Gw(gw, prrlist[gw], NUM_DEDICATED_SLOTS, NUM_DEDICATED_SLOTS))
+
+    slotframe = partialSlotframe(len(packetsPerGw), totalSlots, sharedSlots)
+
+    simulation = Simulation(stats, gws, slotframe, traffic, ccaSuccessProb,
+                            algorithm, NUM_SHARED_SLOTS_PER_SECOND, False)
+    simulation.run()
+
+    stats.gwlist = gws
+    stats.asn += 1
+    stats.pdr = calculatePdr(gws)
+    return simulation
 
 
 #
 # Simulates an operation with only dedicated (collision free) slots.
 #  
-def simulateDedicated(stats, packetsPerGw, prrlist, adaptive, slots, slotsMax):
+def simulateDedicated(stats, packetsPerGw, prrlist, adaptive, slots, slotsMax, trafficSources = None):
 
-    slotframe = [INACTIVE] * SLOTFRAME_SIZE
-    traffic = getTraffic(packetsPerGw)
+    traffic = getTraffic(packetsPerGw, trafficSources)
     gws = []
     for gw in range(len(packetsPerGw)):
         gws.append(Gw(gw, prrlist[gw], slots, slotsMax))
 
-    sn = 0
-    for slot in range(slots):
-        section = list(range(len(packetsPerGw)))
-        random.shuffle(section)
-        for gw in section:
-            slotframe[sn] = gw
-            sn += 1
+    slotframe = dedicatedSlotframe(len(packetsPerGw), slots)
 
-#    print(slotframe)
+    simulation = Simulation(stats, gws, slotframe, traffic, 0.0, ALGORITHM_CONTIKI, 0, adaptive)
+    simulation.run()
+    simulation.finish()
+    return simulation
+
+#
+# Simulates an operation with the given `slotframe` (see `partialSlotframe()`).
+#
+def simulateSlotframe(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe,
+                      trafficSources = None):
+    if len(slotframe) != SLOTFRAME_SIZE:
+        raise ValueError("the slotframe has {} slots instead of {}".format(len(slotframe), SLOTFRAME_SIZE))
+    traffic = getTraffic(packetsPerGw, trafficSources)
 
-    for s in range(NUM_SLOTFRAMES):
-        for slot in range(SLOTFRAME_SIZE):
-            asn = s * SLOTFRAME_SIZE + slot
-            simSlot(stats, gws, asn, slotframe, traffic, 0.0, ALGORITHM_CONTIKI, 0, adaptive)
+    gws = []
+    for gw in range(len(packetsPerGw)):
+        numSlots = slotframe.count(gw)
+        gws.append(Gw(gw, prrlist[gw], numSlots, numSlots))
 
-    stats.gwlist = gws
-    stats.asn = asn+1
+    simulation = Simulation(stats, gws, list(slotframe), traffic, ccaSuccessProb,
+                            algorithm, slotframe.count(SHARED), False)
+    simulation.run()
+    simulation.finish()
+    return simulation
 
-    S = 0
-    T = 0
-    for i in range(len(packetsPerGw)):
-        if(gws[i].numOkPackets + gws[i].numLostPackets) > 0:
-            S = S + 100.0 * gws[i].numOkPackets / (gws[i].numOkPackets + gws[i].numLostPackets)
-            T = T + 1
-    stats.pdr = S/T
+#
+# Simulates an operation with `totalSlots` active slots, `sharedSlots` of which
+# are shared, choosing the right simulation function for the configuration.
+# If there are too few slots left for dedicated cells, only the shared slots are used.
+#
+def simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                trafficSources = None):
+    if sharedSlots == 0:
+        return simulateDedicated(stats, packetsPerGw, prrlist, False, totalSlots // len(packetsPerGw), 0,
+                                 trafficSources)
+    elif sharedSlots >= totalSlots or (totalSlots - sharedSlots) // len(packetsPerGw) == 0:
+        return simulateShared(stats, packetsPerGw, prrlist, ccaSuccessProb, sharedSlots, trafficSources)
+    else:
+        return simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots,
+                        trafficSources)
+
+#######################################################
+
+#
+# Multi-channel slotframes.
+#
+# A multi-channel slotframe has a list of cells for each timeslot. A cell is a
+# (channelOffset, owner) pair, where the owner is a gateway ID for a dedicated
+# cell or SHARED for a shared cell. Only the occupied cells are listed, so the
+# cost of a timeslot depends on the number of its cells, not on the number of
+# channels. Transmissions on the same channel offset in the same timeslot
+# collide; transmissions on different channel offsets are received in parallel
+# by different radios of the receiver. A gateway uses at most `gw.radios` cells
+# in a timeslot: the dedicated cells of a timeslot are served before its shared
+# cells, whatever their order in the list.
+#
+
+#
+# Selects the packets sent in a shared cell, out of the gateways in `backlog`
+# that still have a free radio in this timeslot, like `getPacketsContiki`.
+#
+def getPacketsShared(backlog, radiosUsed, numSharedCells):
+    packets = []
+    sampler = None
+    for gw in backlog:
+        if not gw.queue or radiosUsed.get(gw.id, 0) >= gw.radios:
+            continue
+        r = random.random()
+        C = len(gw.queue)
+        if gw.sampler is None:
+            ok = r <= (C / float(numSharedCells))
+        else:
+            sampler = gw.sampler
+            ok = sampler.transmitOk(r, C / float(numSharedCells), gw)
+        if ok:
+            packets.append(gw.queue.pop(0))
+            radiosUsed[gw.id] = radiosUsed.get(gw.id, 0) + 1
+    if sampler is not None:
+        sampler.contention(packets)
+    return packets
+
+#
+# This simulates a single timeslot of a multi-channel slotframe.
+#
+def simSlotMultiChannel(stats, gws, asn, cells, traffic, ccaSuccessProb, numSharedCells):
+    si = asn % SLOTFRAME_SIZE
+    traffic.scheduleArrivals(asn, gws)
+
+    slotCells = cells[si]
+    if not slotCells:
+        stats.sleeping += 1
+        return
+
+    # first select the packets of all cells, so that a packet that fails
+    # is not sent again in another cell of the same timeslot;
+    # the dedicated cells first, then the shared cells with the radios left
+    radiosUsed = {}
+    channels = {}
+    for channel, owner in slotCells:
+        if owner == SHARED:
+            continue
+        gw = gws[owner]
+        packets = []
+        if gw.queue and radiosUsed.get(owner, 0) < gw.radios:
+            packets.append(gw.queue.pop(0))
+            radiosUsed[owner] = radiosUsed.get(owner, 0) + 1
+        elif not gw.queue:
+            gw.u = (1 - gw.alpha) * gw.u
+        channels.setdefault(channel, []).extend(packets)
+    backlog = None
+    for channel, owner in slotCells:
+        if owner != SHARED:
+            continue
+        if backlog is None:
+            backlog = [gw for gw in gws if gw.queue]
+        channels.setdefault(channel, []).extend(getPacketsShared(backlog, radiosUsed, numSharedCells))
+
+    for packets in channels.values():
+        if len(packets) == 1:
+            packet = packets[0]
+            packet.gw.u = (1 - packet.gw.alpha) * packet.gw.u + packet.gw.alpha * 1
+            if not packet.send(asn):
+                packet.gw.schedulePacket(packet)
+            packet.gw.col = 0
+            stats.txrx += 1
+        elif len(packets) > 1:
+            resolveCollision(stats, packets, ccaSuccessProb, asn)
+        else:
+            stats.idlelistening += 1
+
+class MultiChannelSimulation(Simulation):
+    def simulateSlot(self, asn):
+        simSlotMultiChannel(self.stats, self.gws, asn, self.slotframe, self.traffic,
+                            self.ccaSuccessProb, self.numSharedSlots)
+
+#
+# Builds a multi-channel slotframe with `dedicatedPerGw` dedicated cells for each gateway
+# and `sharedCells` shared cells, using at most `numChannels` channel offsets and
+# `receiverRadios` cells in each timeslot, and at most `gwRadios` cells of the same gateway
+# in a timeslot. The shared cells are spread evenly between the dedicated cells, and
+# all cells evenly over the timeslots of the slotframe, so that the cells of each gateway
+# keep up with its arrivals; the channel offsets are only stacked when there are more
+# cells than timeslots.
+#
+def buildMultiChannelSlotframe(numGws, dedicatedPerGw, sharedCells, numChannels,
+                               receiverRadios = 1, gwRadios = 1):
+    # the order of the cells, like in simulatePartial
+    order = []
+    ns = 0
+    numss = 0
+    for slot in range(dedicatedPerGw):
+        section = list(range(numGws))
+        random.shuffle(section)
+        order.extend(section)
+        ns += sharedCells / float(dedicatedPerGw)
+        for i in range(int(ns)):
+            if numss < sharedCells:
+                order.append(SHARED)
+                numss += 1
+        ns -= int(ns)
+    order.extend([SHARED] * (sharedCells - numss))
+
+    # spread the cells over the timeslots, each in the first one from its share where it fits
+    perSlot = min(numChannels, receiverRadios)
+    if len(order) > perSlot * SLOTFRAME_SIZE:
+        raise ValueError("the cells do not fit in the slotframe")
+    cells = [[] for _ in range(SLOTFRAME_SIZE)]
+    for i, owner in enumerate(order):
+        first = i * SLOTFRAME_SIZE // len(order)
+        for d in range(SLOTFRAME_SIZE):
+            s = (first + d) % SLOTFRAME_SIZE
+            if len(cells[s]) < perSlot and (owner == SHARED or
+                    sum(1 for c, o in cells[s] if o == owner) < gwRadios):
+                break
+        else:
+            raise ValueError("the cells do not fit in the slotframe")
+        cells[s].append((len(cells[s]), owner))
+    cells = [tuple(slotCells) for slotCells in cells]
+    return cells
+
+#
+# Simulates an operation with a multi-channel slotframe `cells`.
+#
+def simulateMultiChannel(stats, packetsPerGw, prrlist, ccaSuccessProb, cells,
+                         receiverRadios = 1, gwRadios = 1, trafficSources = None):
+    for slotCells in cells:
+        if len(set(c for c, o in slotCells)) > receiverRadios:
+            raise ValueError("more channels in a timeslot than receiver radios: {}".format(slotCells))
+    traffic = getTraffic(packetsPerGw, trafficSources)
+    numSharedCells = sum(1 for slotCells in cells for c, o in slotCells if o == SHARED)
+
+    gws = []
+    for gw in range(len(packetsPerGw)):
+        numCells = sum(1 for slotCells in cells for c, o in slotCells if o == gw)
+        gws.append(Gw(gw, prrlist[gw], numCells, numCells))
+        gws[gw].radios = gwRadios
+
+    simulation = MultiChannelSimulation(stats, gws, cells, traffic, ccaSuccessProb,
+                                        ALGORITHM_CONTIKI, numSharedCells, False)
+    simulation.run()
+    simulation.finish()
+    return simulation
 
 #######################################################
 
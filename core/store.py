@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# A results store for parameter sweeps.
+#
+# Each run is stored as a row of an SQLite database, with its configuration
+# (the simulation function, the sweep parameters and the settings of sim.py)
+# and its summary metrics, plus the complete job result as JSON. The rows are
+# written in batched transactions, and the sweep parameters are indexed, so
+# that queries over many runs do not need to scan the whole table.
+#
+# Runs are identified by a key computed from their job (see jobs.py), so the
+# store also works as a cache: a sweep that is interrupted can be restarted,
+# and only the jobs that have no results yet are simulated again. Identical
+# jobs without a seed are independent replications; `runJobs()` numbers them
+# in their order in the sweep (the `replication` of the job), so that each one
+# has its own row and a restarted sweep finds them again.
+#
+#    store = ResultStore("results.db")
+#    for result in store.runJobs(jobList):
+#        ...
+#    print(store.bestSharedSlots())
+#
+
+import sqlite3, json, hashlib
+
+import sim
+import jobs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL UNIQUE,
+    function TEXT NOT NULL,
+    packets_key TEXT NOT NULL,
+    prr_key TEXT NOT NULL,
+    num_gws INTEGER,
+    cca REAL,
+    algorithm INTEGER,
+    total_slots INTEGER,
+    shared_slots INTEGER,
+    seed INTEGER,
+    replication INTEGER,
+    num_slotframes INTEGER,
+    slotframe_size INTEGER,
+    num_tx INTEGER,
+    max_queue INTEGER,
+    do_cca INTEGER,
+    pdr REAL,
+    energy REAL,
+    enef REAL,
+    collisions_tx INTEGER,
+    collisions_rx INTEGER,
+    txrx INTEGER,
+    traffic INTEGER,
+    time REAL,
+    result TEXT NOT NULL
+);
+DROP INDEX IF EXISTS runs_sweep;
+CREATE INDEX IF NOT EXISTS runs_best ON runs (prr_key, packets_key, function, algorithm, total_slots, cca,
+                                              num_slotframes, shared_slots, pdr);
+CREATE INDEX IF NOT EXISTS runs_config ON runs (function, total_slots, shared_slots, cca, algorithm);
+"""
+
+COLUMNS = ["key", "function", "packets_key", "prr_key", "num_gws", "cca", "algorithm",
+           "total_slots", "shared_slots", "seed", "replication", "num_slotframes", "slotframe_size",
+           "num_tx", "max_queue", "do_cca", "pdr", "energy", "enef",
+           "collisions_tx", "collisions_rx", "txrx", "traffic", "time", "result"]
+
+# The metrics that can be optimised in queries
+METRICS = ["pdr", "energy", "enef", "collisions_tx", "collisions_rx"]
+
+######################################
+
+#
+# A canonical string of a list of numbers, used as the sweep key of PRR and traffic vectors.
+#
+def vectorKey(values):
+    return json.dumps([round(float(v), 6) for v in values])
+
+#
+# Identifies a job by its function, arguments, settings, seed and replication.
+#
+def jobKey(job):
+    data = json.dumps([job["function"], job["args"], job.get("config", {}), job.get("seed"),
+                       job.get("replication")], sort_keys = True)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+#
+# Returns the jobs with the identical unseeded ones numbered as replications 0, 1, ...
+# The jobs that have a seed or a replication already are kept as they are.
+#
+def numberReplications(jobList):
+    counts = {}
+    result = []
+    for job in jobList:
+        if job.get("seed") is None and job.get("replication") is None:
+            key = jobKey(job)
+            job = dict(job)
+            job["replication"] = counts.get(key, 0)
+            counts[key] = job["replication"] + 1
+        result.append(job)
+    return result
+
+#
+# The sweep parameters of a job, by the arguments of its sim.simulate* function.
+#
+def jobParams(job):
+    function = job["function"]
+    args = job["args"]
+    params = {"packetsPerGw": args[0], "prrlist": args[1],
+              "cca": None, "algorithm": None, "totalSlots": None, "sharedSlots": None}
+    if function == "simulateDedicated":
+        # packetsPerGw, prrlist, adaptive, slots, slotsMax
+        params["totalSlots"] = args[3] * len(args[0])
+        params["sharedSlots"] = 0
+    elif function == "simulateShared":
+        # packetsPerGw, prrlist, ccaSuccessProb, total_shared
+        params["cca"] = args[2]
+        params["totalSlots"] = params["sharedSlots"] = args[3]
+    elif function == "simulateSlotframe":
+        # packetsPerGw, prrlist, ccaSuccessProb, algorithm, slotframe
+        params["cca"] = args[2]
+        params["algorithm"] = int(args[3])
+        params["totalSlots"] = len([owner for owner in args[4] if owner != sim.INACTIVE])
+        params["sharedSlots"] = args[4].count(sim.SHARED)
+    else:
+        # packetsPerGw, prrlist, ccaSuccessProb, algorithm, totalSlots, sharedSlots
+        params["cca"] = args[2]
+        params["algorithm"] = int(args[3])
+        params["totalSlots"] = args[4]
+        params["sharedSlots"] = args[5]
+    return params
+
+######################################
+
+class ResultStore:
+    def __init__(self, filename, batchSize = 1000):
+        self.filename = filename
+        self.batchSize = batchSize
+        # the rows not written yet, by key
+        self.pending = {}
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.flush()
+        self.db.close()
+
+    #
+    # Adds the result of a job. The rows are written when `batchSize` of them
+    # have been added, or on `flush()`, `query()` or `close()`; until then, `get()`
+    # finds them in memory. Failed jobs are not stored.
+    #
+    def add(self, job, result):
+        if "error" in result:
+            return
+        params = jobParams(job)
+        config = job.get("config", {})
+        row = (jobKey(job), job["function"],
+               vectorKey(params["packetsPerGw"]), vectorKey(params["prrlist"]),
+               len(params["packetsPerGw"]), params["cca"], params["algorithm"],
+               params["totalSlots"], params["sharedSlots"], job.get("seed"), job.get("replication"),
+               config.get("NUM_SLOTFRAMES"), config.get("SLOTFRAME_SIZE"),
+               config.get("NUM_TX"), config.get("MAX_QUEUE"),
+               None if config.get("DO_CCA") is None else int(config["DO_CCA"]),
+               result["pdr"], result["energy"], result["enef"],
+               result["collisionsTx"], result["collisionsRx"], result["txrx"], result["traffic"],
+               result.get("time"), json.dumps(result))
+        self.pending[row[0]] = row
+        if len(self.pending) >= self.batchSize:
+            self.flush()
+
+    #
+    # Writes the added rows in a single transaction.
+    # A run that is already stored is replaced.
+    #
+    def flush(self):
+        if not self.pending:
+            return
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO runs ({}) VALUES ({})".format(
+                ", ".join(COLUMNS), ", ".join("?" * len(COLUMNS))), list(self.pending.values()))
+        self.pending = {}
+
+    #
+    # The stored result of a job, or None.
+    #
+    def get(self, job):
+        key = jobKey(job)
+        if key in self.pending:
+            return json.loads(self.pending[key][-1])
+        row = self.db.execute("SELECT result FROM runs WHERE key = ?", (key,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def __contains__(self, job):
+        return self.get(job) is not None
+
+    def __len__(self):
+        stored = self.db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+        return stored + len(self.pending) - len(self.written(list(self.pending)))
+
+    #
+    # The keys that are in the database.
+    #
+    def written(self, keys):
+        found = set()
+        # look the keys up in chunks, staying under the limit of SQL variables
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i+500]
+            found.update(row[0] for row in self.db.execute(
+                "SELECT key FROM runs WHERE key IN ({})".format(", ".join("?" * len(chunk))), chunk))
+        return found
+
+    #
+    # The jobs of a sweep that do not have stored results yet.
+    #
+    def missing(self, jobList):
+        keys = [jobKey(job) for job in jobList]
+        found = self.written([key for key in keys if key not in self.pending])
+        found.update(self.pending)
+        return [job for job, key in zip(jobList, keys) if key not in found]
+
+    #
+    # Yields the results of the jobs: the stored ones first, then the rest,
+    # run with `jobs.runJobs()` and stored as they complete.
+    #
+    def runJobs(self, jobList, processes = None, progress = None):
+        jobList = numberReplications(jobList)
+        missing = self.missing(jobList)
+        missingIds = set(id(job) for job in missing)
+        for job in jobList:
+            if id(job) not in missingIds:
+                result = self.get(job)
+                result["cached"] = True
+                if progress is not None:
+                    progress.jobDone()
+                yield result
+        # the results come in the order of completion; find their jobs by the index
+        indexed = []
+        for i, job in enumerate(missing):
+            job = dict(job)
+            job["id"] = [i, job.get("id")]
+            indexed.append(job)
+        try:
+            for result in jobs.runJobs(indexed, processes, progress):
+                i, result["id"] = result["id"]
+                self.add(missing[i], result)
+                yield result
+        finally:
+            self.flush()
+
+    ######################################
+
+    #
+    # Runs an SQL query on the store and returns the rows.
+    #
+    def query(self, sql, params = ()):
+        self.flush()
+        return self.db.execute(sql, params).fetchall()
+
+    #
+    # The best number of shared slots for each PRR vector, traffic vector and
+    # configuration (the function, algorithm, total slots, CCA success probability
+    # and number of slotframes), by the mean of `metric` over the repeated runs
+    # (the highest one; the lowest with `minimize`). Returns a list of (prrlist,
+    # packetsPerGw, config, sharedSlots, value, runs) with `config` a dictionary.
+    # With `prrlist`, `function` or `algorithm` given, only the matching runs are considered.
+    #
+    def bestSharedSlots(self, metric = "pdr", minimize = False, prrlist = None, function = None,
+                        algorithm = None):
+        if metric not in METRICS:
+            raise ValueError("unknown metric: {}".format(metric))
+        where = []
+        params = []
+        if prrlist is not None:
+            where.append("prr_key = ?")
+            params.append(vectorKey(prrlist))
+        if function is not None:
+            where.append("function = ?")
+            params.append(function)
+        if algorithm is not None:
+            where.append("algorithm = ?")
+            params.append(int(algorithm))
+        config = "function, algorithm, total_slots, cca, num_slotframes"
+        # SQLite takes the bare columns of a MIN() / MAX() query from the row with that value
+        sql = """SELECT prr_key, packets_key, {config}, shared_slots, {best}(value), runs FROM
+                 (SELECT prr_key, packets_key, {config}, shared_slots, AVG({metric}) AS value, COUNT(*) AS runs
+                  FROM runs {where} GROUP BY prr_key, packets_key, {config}, shared_slots)
+                 GROUP BY prr_key, packets_key, {config}""".format(config = config,
+                     best = "MIN" if minimize else "MAX", metric = metric,
+                     where = "WHERE " + " AND ".join(where) if where else "")
+        return [(json.loads(row[0]), json.loads(row[1]),
+                 {"function": row[2], "algorithm": row[3], "totalSlots": row[4], "cca": row[5],
+                  "numSlotframes": row[6]},
+                 row[7], row[8], row[9])
+                for row in self.query(sql, params)]
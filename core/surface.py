@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Precomputed PDR and energy surface with fast interpolated lookup.
+#
+# The simulator is run once for each point of a grid over
+# (PRR, traffic, slots, shared slots, gateways), with the same PRR and traffic
+# on all gateways, and the results are stored in a flat table indexed by
+# the grid coordinates. A query multilinearly interpolates between the
+# 2^5 corners of the enclosing grid cell, which takes microseconds instead
+# of a full simulation, and returns an estimate of the error.
+#
+# The grid can be refined adaptively: new grid lines are inserted in
+# the middle of the intervals where the surface bends the most.
+#
+# Usage:
+#
+#    s = surface.Surface([[0.5, 0.7, 0.9], [4, 8], [40, 80], [0, 16], [4]])
+#    s.build(repeat = 3)
+#    s.refine(10)
+#    s.save("surface.bin")
+#    pdr, err = surface.load("surface.bin").query(0.8, 6, 80, 8, 4)
+#
+
+import bisect, json, math
+from array import array
+
+import sim
+
+AXES = ["prr", "traffic", "slots", "sharedSlots", "gateways"]
+# The axes that only take integer values
+INTEGER_AXES = [False, True, True, True, True]
+
+METRICS = ["pdr", "energy", "enef"]
+
+NAN = float("nan")
+
+######################################
+
+#
+# Simulates a single grid point `repeat` times.
+# Returns the means and the standard errors of the metrics.
+#
+def evaluate(point, repeat, algorithm, ccaSuccessProb):
+    prr, traffic, slots, sharedSlots, gateways = point
+    nan = [NAN] * len(METRICS)
+    if gateways < 1 or sharedSlots > slots or slots > sim.SLOTFRAME_SIZE:
+        return nan, nan
+    if sharedSlots == 0 and slots < gateways:
+        return nan, nan
+
+    packetsPerGw = [traffic] * gateways
+    prrlist = [prr] * gateways
+    samples = [[] for _ in METRICS]
+    for r in range(repeat):
+        stats = sim.Statistics(packetsPerGw)
+        sim.simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, slots, sharedSlots)
+        samples[0].append(stats.pdr)
+        samples[1].append(stats.energy())
+        try:
+            samples[2].append(stats.enef())
+        except ZeroDivisionError:
+            samples[2].append(NAN)
+
+    means = []
+    errors = []
+    for lst in samples:
+        m, sd = sim.std(lst)
+        means.append(m)
+        errors.append(sd / math.sqrt(len(lst) - 1) if len(lst) > 1 else 0.0)
+    return means, errors
+
+#
+# Second derivative from three points with arbitrary spacing.
+#
+def secondDerivative(x0, x1, x2, f0, f1, f2):
+    return 2.0 * ((f2 - f1) / (x2 - x1) - (f1 - f0) / (x1 - x0)) / (x2 - x0)
+
+######################################
+
+class Surface:
+    def __init__(self, axes, repeat = 1, algorithm = sim.ALGORITHM_CONTIKI, ccaSuccessProb = 0.7):
+        if len(axes) != len(AXES):
+            raise ValueError("expected {} axes: {}".format(len(AXES), ", ".join(AXES)))
+        self.axes = [sorted(set(axis)) for axis in axes]
+        self.repeat = repeat
+        self.algorithm = algorithm
+        self.ccaSuccessProb = ccaSuccessProb
+        self.values = None
+        self.errors = None
+        # simulated points; kept so that refinement does not rerun them
+        self.cache = {}
+        self.updateStrides()
+
+    def updateStrides(self):
+        self.strides = [0] * len(self.axes)
+        n = 1
+        for k in reversed(range(len(self.axes))):
+            self.strides[k] = n
+            n *= len(self.axes[k])
+        self.size = n
+
+    def points(self):
+        indices = [0] * len(self.axes)
+        for flat in range(self.size):
+            rest = flat
+            for k in range(len(self.axes)):
+                indices[k] = rest // self.strides[k]
+                rest %= self.strides[k]
+            yield flat, tuple(self.axes[k][indices[k]] for k in range(len(self.axes)))
+
+    #
+    # Simulates all grid points that are not simulated yet and fills the table.
+    #
+    def build(self, repeat = None):
+        if repeat is not None:
+            self.repeat = repeat
+        self.values = dict((m, array('d', [NAN]) * self.size) for m in METRICS)
+        self.errors = dict((m, array('d', [NAN]) * self.size) for m in METRICS)
+        for flat, point in self.points():
+            if point not in self.cache:
+                self.cache[point] = evaluate(point, self.repeat, self.algorithm, self.ccaSuccessProb)
+            means, errors = self.cache[point]
+            for i in range(len(METRICS)):
+                self.values[METRICS[i]][flat] = means[i]
+                self.errors[METRICS[i]][flat] = errors[i]
+
+    #
+    # Estimates the worst linear interpolation error in each interval of each axis,
+    # using the second derivative of `metric` along that axis.
+    # Returns a list of (error, axis, interval index) tuples.
+    #
+    def intervalErrors(self, metric = "pdr"):
+        values = self.values[metric]
+        result = []
+        for k in range(len(self.axes)):
+            axis = self.axes[k]
+            stride = self.strides[k]
+            for j in range(len(axis) - 1):
+                if INTEGER_AXES[k] and axis[j + 1] - axis[j] < 2:
+                    continue # cannot be refined
+                h = axis[j + 1] - axis[j]
+                worst = 0.0
+                for flat, point in self.points():
+                    if flat // stride % len(axis) != j:
+                        continue
+                    f0 = values[flat]
+                    f1 = values[flat + stride]
+                    if len(axis) < 3:
+                        # no curvature information; assume the error can be half of the change
+                        e = abs(f1 - f0) / 2.0
+                    else:
+                        e = 0.0
+                        for i in (j - 1, j):
+                            if 0 <= i and i + 2 < len(axis):
+                                base = flat + (i - j) * stride
+                                d2 = secondDerivative(axis[i], axis[i + 1], axis[i + 2],
+                                                      values[base], values[base + stride], values[base + 2 * stride])
+                                e = max(e, abs(d2) * h * h / 8.0)
+                    if e > worst: # false for NaN
+                        worst = e
+                result.append((worst, k, j))
+        return result
+
+    #
+    # Inserts up to `steps` new grid lines, each in the middle of the interval with
+    # the largest estimated interpolation error, simulating the new points.
+    # Stops early if no interval has error above `tolerance`.
+    #
+    def refine(self, steps, tolerance = 0.0, metric = "pdr"):
+        if self.values is None:
+            self.build()
+        for step in range(steps):
+            candidates = self.intervalErrors(metric)
+            if not candidates:
+                break
+            error, k, j = max(candidates)
+            if error <= tolerance:
+                break
+            axis = self.axes[k]
+            mid = (axis[j] + axis[j + 1]) / 2.0
+            if INTEGER_AXES[k]:
+                mid = int(mid)
+            axis.insert(j + 1, mid)
+            self.updateStrides()
+            self.build()
+
+    #
+    # Interpolates `metric` at the given point.
+    # Returns the value and an error estimate, which combines the expected interpolation
+    # error with the interpolated standard error of the simulated points.
+    # Points outside of the grid are clamped to its boundary.
+    #
+    def query(self, prr, traffic, slots, sharedSlots, gateways, metric = "pdr"):
+        point = (prr, traffic, slots, sharedSlots, gateways)
+        values = self.values[metric]
+        errors = self.errors[metric]
+        dims = len(self.axes)
+        lows = [0] * dims
+        ts = [0.0] * dims
+        base = 0
+        for k in range(dims):
+            axis = self.axes[k]
+            if len(axis) > 1:
+                i = bisect.bisect_right(axis, point[k]) - 1
+                i = min(max(i, 0), len(axis) - 2)
+                t = (point[k] - axis[i]) / float(axis[i + 1] - axis[i])
+                lows[k] = i
+                ts[k] = min(max(t, 0.0), 1.0)
+            base += lows[k] * self.strides[k]
+
+        value = 0.0
+        sampling = 0.0
+        for corner in range(1 << dims):
+            w = 1.0
+            flat = base
+            for k in range(dims):
+                if (corner >> k) & 1:
+                    if len(self.axes[k]) == 1:
+                        w = 0.0
+                        break
+                    w *= ts[k]
+                    flat += self.strides[k]
+                else:
+                    w *= 1.0 - ts[k]
+            if w != 0.0:
+                value += w * values[flat]
+                sampling += w * errors[flat]
+
+        # interpolation error along each axis, at the grid point nearest to the query
+        nearest = base
+        for k in range(dims):
+            if ts[k] > 0.5:
+                nearest += self.strides[k]
+        interpolation = 0.0
+        for k in range(dims):
+            axis = self.axes[k]
+            if len(axis) < 3 or ts[k] == 0.0 or ts[k] == 1.0:
+                continue
+            stride = self.strides[k]
+            i = min(max(lows[k] - 1, 0), len(axis) - 3)
+            f = nearest + (i - (lows[k] + (ts[k] > 0.5))) * stride
+            d2 = secondDerivative(axis[i], axis[i + 1], axis[i + 2],
+                                  values[f], values[f + stride], values[f + 2 * stride])
+            h = axis[lows[k] + 1] - axis[lows[k]]
+            interpolation += abs(d2) * h * h * ts[k] * (1.0 - ts[k]) / 2.0
+
+        return value, interpolation + sampling
+
+    #
+    # Stores the table in a compact binary file: a JSON header line followed
+    # by the values and the errors of each metric as arrays of doubles.
+    #
+    def save(self, filename):
+        header = {"axes": self.axes, "metrics": METRICS, "repeat": self.repeat,
+                  "algorithm": self.algorithm, "ccaSuccessProb": self.ccaSuccessProb}
+        with open(filename, "wb") as f:
+            f.write((json.dumps(header) + "\n").encode("utf-8"))
+            for m in METRICS:
+                self.values[m].tofile(f)
+                self.errors[m].tofile(f)
+
+#
+# Loads a table stored with `Surface.save()`.
+#
+def load(filename):
+    with open(filename, "rb") as f:
+        header = json.loads(f.readline().decode("utf-8"))
+        s = Surface(header["axes"], header["repeat"], header["algorithm"], header["ccaSuccessProb"])
+        s.values = {}
+        s.errors = {}
+        for m in header["metrics"]:
+            s.values[m] = array('d')
+            s.values[m].fromfile(f, s.size)
+            s.errors[m] = array('d')
+            s.errors[m].fromfile(f, s.size)
+    return s
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Time-series telemetry of a simulation run.
+#
+# Samples per-gateway and global metrics every `period` slotframes into
+# fixed-size typed arrays. When the arrays are full, every other sample is
+# dropped and the sampling period is doubled, so the memory use is bounded
+# by `capacity` samples per metric regardless of the length of the run,
+# while the samples still cover the whole run.
+#
+# Usage:
+#
+#    stats = sim.Statistics(packetsPerGw)
+#    stats.telemetry = telemetry.Telemetry(period = 10)
+#    sim.simulateDedicated(stats, ...)
+#    print(stats.telemetry.get("txrx"), stats.telemetry.getGw(0, "queue"))
+#
+
+from array import array
+
+# Global metrics: cumulative Statistics counters and the total queue size
+GLOBAL_METRICS = ["txrx", "collisionsTx", "collisionsRx", "idlelistening", "sleeping", "queue"]
+
+# Per-gateway metrics
+GW_METRICS = ["queue", "u", "aslot", "ok", "lost"]
+
+######################################
+
+class Telemetry:
+    def __init__(self, period = 1, capacity = 1024):
+        self.period = period
+        self.capacity = capacity + capacity % 2 # must be even for the downsampling
+        self.frames = 0
+        self.asn = array('l')
+        self.series = {}
+        for name in GLOBAL_METRICS:
+            self.series[name] = array('l')
+        self.gwSeries = None
+
+    def __len__(self):
+        return len(self.asn)
+
+    #
+    # Called by the simulator at the end of each slotframe.
+    #
+    def slotframeEnd(self, asn, stats, gws):
+        self.frames += 1
+        if self.frames % self.period == 0:
+            if len(self.asn) >= self.capacity:
+                self.downsample()
+                if self.frames % self.period != 0:
+                    return
+            self.sample(asn, stats, gws)
+
+    def sample(self, asn, stats, gws):
+        if self.gwSeries is None:
+            self.gwSeries = [dict((name, array('d')) for name in GW_METRICS) for gw in gws]
+
+        self.asn.append(asn)
+        series = self.series
+        series["txrx"].append(stats.txrx)
+        series["collisionsTx"].append(stats.collisionsTx)
+        series["collisionsRx"].append(stats.collisionsRx)
+        series["idlelistening"].append(stats.idlelistening)
+        series["sleeping"].append(stats.sleeping)
+
+        total = 0
+        for gw in gws:
+            s = self.gwSeries[gw.id]
+            s["queue"].append(len(gw.queue))
+            s["u"].append(gw.u)
+            s["aslot"].append(gw.aslot)
+            s["ok"].append(gw.numOkPackets)
+            s["lost"].append(gw.numLostPackets)
+            total += len(gw.queue)
+        series["queue"].append(total)
+
+    #
+    # Keeps every other sample and halves the sampling rate.
+    # The most recent sample is always kept.
+    #
+    def downsample(self):
+        start = (len(self.asn) - 1) % 2
+        self.asn = self.asn[start::2]
+        for name in self.series:
+            self.series[name] = self.series[name][start::2]
+        for s in self.gwSeries:
+            for name in s:
+                s[name] = s[name][start::2]
+        self.period *= 2
+
+    #
+    # Returns the ASNs at which the samples were taken.
+    #
+    def asns(self):
+        return list(self.asn)
+
+    def get(self, name):
+        return list(self.series[name])
+
+    def getGw(self, gwId, name):
+        return list(self.gwSeries[gwId][name])
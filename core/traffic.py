@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2016-2017, University of Bristol - http://www.bristol.ac.uk
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#  * Redistributions of source code must retain the above copyright notice,
+#    this list of  conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above copyright
+#   notice, this list of conditions and the following disclaimer in the
+#   documentation and/or other materials provided with the distribution.
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS"
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL,
+# EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO,
+# PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS;
+# OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR
+# OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF
+# ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+#
+# Traffic sources for the simulator.
+#
+# Each source produces the ASNs of new packet arrivals for a single gateway,
+# one at a time, by sampling the time until the next arrival. Nothing is
+# stored per timeslot, so the memory use does not depend on the slotframe
+# size, and the simulator only does work when a packet actually arrives.
+#
+# A source implements `nextArrival()`, returning the ASN of the next arrival
+# (never smaller than the previous one) or None when there are no more.
+# Several packets may arrive in the same timeslot.
+#
+
+import heapq, random, struct, mmap
+
+######################################
+
+#
+# Evenly spaced arrivals, `packetsPerFrame` times in each slotframe.
+# This is the traffic pattern of the original dense traffic matrix:
+# the arrivals happen in the slots `i * (slotframeSize // packetsPerFrame)`.
+#
+class PeriodicTraffic:
+    def __init__(self, packetsPerFrame, slotframeSize):
+        self.packetsPerFrame = packetsPerFrame
+        self.slotframeSize = slotframeSize
+        self.skip = slotframeSize // packetsPerFrame if packetsPerFrame else 0
+        self.frame = 0
+        self.index = -1
+
+    def nextArrival(self):
+        if self.packetsPerFrame <= 0:
+            return None
+        self.index += 1
+        if self.index >= self.packetsPerFrame:
+            self.index = 0
+            self.frame += 1
+        return self.frame * self.slotframeSize + self.index * self.skip
+
+#
+# Periodic arrivals, each one delayed by a uniformly distributed random
+# jitter of up to `maxJitter` slots. The order of arrivals is preserved.
+#
+class JitteredTraffic:
+    def __init__(self, packetsPerFrame, slotframeSize, maxJitter):
+        self.periodic = PeriodicTraffic(packetsPerFrame, slotframeSize)
+        self.maxJitter = maxJitter
+        self.last = 0
+
+    def nextArrival(self):
+        t = self.periodic.nextArrival()
+        if t is None:
+            return None
+        t += int(random.random() * (self.maxJitter + 1))
+        self.last = max(self.last, t)
+        return self.last
+
+#
+# Poisson arrivals with on average `packetsPerFrame` packets per slotframe.
+# The inter-arrival times are sampled from the exponential distribution.
+#
+class PoissonTraffic:
+    def __init__(self, packetsPerFrame, slotframeSize):
+        self.rate = float(packetsPerFrame) / slotframeSize # packets per slot
+        self.time = 0.0
+
+    def nextArrival(self):
+        if self.rate <= 0:
+            return None
+        self.time += random.expovariate(self.rate)
+        return int(self.time)
+
+#
+# Bursty on/off traffic. The source alternates between "on" and "off"
+# periods with exponentially distributed durations (the means are given
+# in slots). During the "on" periods the packets arrive as a Poisson
+# process, while during the "off" periods nothing arrives. The rate in the
+# "on" state is chosen so that the long-term average rate still is
+# `packetsPerFrame` packets per slotframe.
+#
+class OnOffTraffic:
+    def __init__(self, packetsPerFrame, slotframeSize, meanOn, meanOff):
+        self.meanOn = float(meanOn)
+        self.meanOff = float(meanOff)
+        self.rate = float(packetsPerFrame) / slotframeSize * (self.meanOn + self.meanOff) / self.meanOn
+        self.time = 0.0
+        self.onEnd = random.expovariate(1.0 / self.meanOn)
+
+    def nextArrival(self):
+        if self.rate <= 0:
+            return None
+        t = self.time + random.expovariate(self.rate)
+        while t >= self.onEnd:
+            # the "on" period ended before the arrival; skip the "off" period
+            # and continue sampling from the start of the next "on" period,
+            # which is valid because the exponential distribution is memoryless
+            t = self.onEnd + random.expovariate(1.0 / self.meanOff)
+            self.onEnd = t + random.expovariate(1.0 / self.meanOn)
+            t += random.expovariate(self.rate)
+        self.time = t
+        return int(t)
+
+######################################
+
+#
+# Recorded traffic traces.
+#
+# A trace file holds the arrival ASNs of each gateway:
+#
+#    8 bytes         magic "TSCHTRC1"
+#    uint32          number of gateways N
+#    uint32          reserved (0)
+#    N * 2 uint64    the byte offset and the number of arrivals of each gateway
+#    ...             the arrival ASNs of each gateway, sorted, as uint64
+#
+# All numbers are little-endian. The file is accessed through a memory map
+# and read in fixed-size chunks, so traces of any size are replayed with
+# constant memory use.
+#
+
+TRACE_MAGIC = b"TSCHTRC1"
+TRACE_CHUNK = 4096 # arrivals read at once
+
+#
+# Writes a trace file. `arrivalsPerGw` holds an iterable of sorted
+# arrival ASNs for each gateway; they are written out as they are produced.
+#
+def writeTrace(filename, arrivalsPerGw):
+    numGws = len(arrivalsPerGw)
+    index = []
+    with open(filename, "wb") as f:
+        f.write(TRACE_MAGIC + struct.pack("<II", numGws, 0))
+        f.write(b"\0" * (16 * numGws))
+        for arrivals in arrivalsPerGw:
+            offset = f.tell()
+            count = 0
+            last = 0
+            chunk = []
+            for asn in arrivals:
+                if asn < last:
+                    raise ValueError("arrivals must be sorted: {} after {}".format(asn, last))
+                last = asn
+                chunk.append(asn)
+                if len(chunk) == TRACE_CHUNK:
+                    f.write(struct.pack("<{}Q".format(len(chunk)), *chunk))
+                    count += len(chunk)
+                    chunk = []
+            f.write(struct.pack("<{}Q".format(len(chunk)), *chunk))
+            count += len(chunk)
+            index.append((offset, count))
+        f.seek(len(TRACE_MAGIC) + 8)
+        for offset, count in index:
+            f.write(struct.pack("<QQ", offset, count))
+
+class TraceFile:
+    def __init__(self, filename):
+        self.filename = filename
+        self.open()
+
+    def open(self):
+        with open(self.filename, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        if self.map[:len(TRACE_MAGIC)] != TRACE_MAGIC:
+            raise ValueError("not a traffic trace file: " + self.filename)
+        self.numGws = struct.unpack_from("<I", self.map, len(TRACE_MAGIC))[0]
+        self.index = [struct.unpack_from("<QQ", self.map, len(TRACE_MAGIC) + 8 + 16 * i)
+                      for i in range(self.numGws)]
+
+    def close(self):
+        self.map.close()
+
+    # the memory map cannot be pickled; reopen the file instead
+    def __getstate__(self):
+        return {"filename": self.filename}
+
+    def __setstate__(self, state):
+        self.filename = state["filename"]
+        self.open()
+
+    def numArrivals(self, gwId):
+        return self.index[gwId][1]
+
+    #
+    # The average number of packets per slotframe of a gateway over the trace.
+    #
+    def packetsPerFrame(self, gwId, slotframeSize):
+        offset, count = self.index[gwId]
+        if count == 0:
+            return 0.0
+        last = struct.unpack_from("<Q", self.map, offset + 8 * (count - 1))[0]
+        return float(count) * slotframeSize / (last + 1)
+
+    def source(self, gwId):
+        return TraceTraffic(self, gwId)
+
+    def sources(self):
+        return [self.source(gwId) for gwId in range(self.numGws)]
+
+#
+# Replays the arrivals of one gateway from a trace file, shifted by `offset` slots.
+#
+class TraceTraffic:
+    def __init__(self, trace, gwId, offset = 0):
+        self.trace = trace
+        self.gwId = gwId
+        self.offset = offset
+        self.position = 0 # index of the next arrival in the trace
+        self.chunk = ()
+        self.chunkStart = 0
+
+    def nextArrival(self):
+        start, count = self.trace.index[self.gwId]
+        if self.position >= count:
+            return None
+        i = self.position - self.chunkStart
+        if i >= len(self.chunk):
+            n = min(TRACE_CHUNK, count - self.position)
+            self.chunk = struct.unpack_from("<{}Q".format(n), self.trace.map, start + 8 * self.position)
+            self.chunkStart = self.position
+            i = 0
+        self.position += 1
+        return self.chunk[i] + self.offset
+
+    # do not pickle the chunk; it is read again after unpickling
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["chunk"] = ()
+        state["chunkStart"] = self.position
+        return state
+
+######################################
+
+#
+# Merges the arrivals of all gateways in a heap ordered by the arrival ASN.
+# Checking whether anything arrives in a timeslot is O(1); each arrival
+# costs O(log N) for N gateways.
+#
+class TrafficSchedule:
+    def __init__(self, sources):
+        self.sources = sources
+        self.heap = []
+        for gwId in range(len(sources)):
+            self.push(gwId)
+        heapq.heapify(self.heap)
+
+    def push(self, gwId):
+        t = self.sources[gwId].nextArrival()
+        if t is not None:
+            self.heap.append((t, gwId))
+
+    #
+    # Calls `gws[i].scheduleNewPacket(asn)` for each packet arriving
+    # at gateway `i` not later than in the timeslot `asn`.
+    #
+    def scheduleArrivals(self, asn, gws):
+        heap = self.heap
+        while heap and heap[0][0] <= asn:
+            gwId = heap[0][1]
+            gws[gwId].scheduleNewPacket(asn)
+            t = self.sources[gwId].nextArrival()
+            if t is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (t, gwId))
+
+    #
+    # The ASN of the next arrival, or None if there are no more.
+    #
+    def peek(self):
+        return self.heap[0][0] if self.heap else None
+
+######################################
+
+#
+# Creates periodic sources matching the `packetsPerGw` list used by the simulator.
+#
+def periodicSources(packetsPerGw, slotframeSize):
+    return [PeriodicTraffic(n, slotframeSize) for n in packetsPerGw]
+
+def poissonSources(packetsPerGw, slotframeSize):
+    return [PoissonTraffic(n, slotframeSize) for n in packetsPerGw]
+
+def onOffSources(packetsPerGw, slotframeSize, meanOn, meanOff):
+    return [OnOffTraffic(n, slotframeSize, meanOn, meanOff) for n in packetsPerGw]
+
+def jitteredSources(packetsPerGw, slotframeSize, maxJitter):
+    return [JitteredTraffic(n, slotframeSize, maxJitter) for n in packetsPerGw]
+
+def traceSources(filename):
+    return TraceFile(filename).sources()
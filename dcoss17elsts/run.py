@@ -33,29 +33,62 @@
 # the 13th International Conference on Distributed Computing in Sensor Systems (DCOSS), IEEE, 
 # Ottawa, Canada, June 2017.
 
-import sys, os, random
+import sys, os, random, itertools
 
 # add library directory to path
 SELF_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.join(SELF_DIR, '..', "core"))
 
 import sim
+import selection
+import batch
+import jobs
+import store
+import progress
+import sensitivity
 
 TOTAL_SLOTS = 80
 
+# If set, the results are stored in this SQLite database, and the runs already in it are not repeated
+RESULTS_DB = os.getenv("RESULTS_DB")
+results = store.ResultStore(RESULTS_DB) if RESULTS_DB else None
+
+# If PROGRESS is set, a status line is shown; if PROGRESS_TEXTFILE is set,
+# the progress metrics are also written to this Prometheus textfile
+PROGRESS_TEXTFILE = os.getenv("PROGRESS_TEXTFILE")
+meter = progress.Progress(textfile = PROGRESS_TEXTFILE) if os.getenv("PROGRESS") or PROGRESS_TEXTFILE else None
+
+# The number of runs of each configuration so far; the repeated runs are stored as replications
+replications = {}
+
 ################################################################################
 
-def simAny(packetsPerGw, prrlist, ccaSuccessProb, algorithm, sharedslots):  
+def simAny(packetsPerGw, prrlist, ccaSuccessProb, algorithm, sharedslots, sampler = None):  
     stats = sim.Statistics(packetsPerGw)
-    if sharedslots == 0:
-        sim.simulateDedicated(stats, packetsPerGw, prrlist, False, TOTAL_SLOTS//len(packetsPerGw), 0)
-    elif sharedslots == TOTAL_SLOTS:
-        sim.simulateShared(stats, packetsPerGw, prrlist, ccaSuccessProb, TOTAL_SLOTS)
+    stats.progress = meter
+    stats.sampler = sampler
+    if results is None or sampler is not None:
+        sim.simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, TOTAL_SLOTS, sharedslots)
     else:
-        sim.simulatePartial(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, TOTAL_SLOTS, sharedslots)
-
+        job = jobs.makeJob("simulateAny", [packetsPerGw, prrlist, ccaSuccessProb, algorithm, TOTAL_SLOTS, sharedslots])
+        key = store.jobKey(job)
+        job["replication"] = replications.get(key, 0)
+        replications[key] = job["replication"] + 1
+        result = results.get(job)
+        if result is None:
+            sim.simulateAny(stats, packetsPerGw, prrlist, ccaSuccessProb, algorithm, TOTAL_SLOTS, sharedslots)
+            results.add(job, jobs.summarize(stats))
+        else:
+            jobs.applyResult(stats, result)
+    if meter is not None:
+        meter.jobDone()
     return stats
 
+# Adds the number of runs of a sweep to the progress meter
+def expectRuns(n):
+    if meter is not None:
+        meter.addJobs(n)
+
 ################################################################################
 
 def exp1(traffic):
@@ -63,6 +96,7 @@ def exp1(traffic):
 
     slot_list = [0,8,16]
     pdr_results = [0] * len(slot_list)
+    expectRuns(len(slot_list) * len(list(itertools.combinations_with_replacement(range(3), 4))))
     
     for sharedslots in range(len(slot_list)):
         
@@ -93,6 +127,7 @@ def exp2(traffic):
 
     A = 0.6 # min link quality (maximal is 1.0)
     N = 8 # number of discrete steps
+    expectRuns(len(slot_list) * len(list(itertools.combinations_with_replacement(range(N+1), 4))))
 
     for sharedslots in range(len(slot_list)):
         i = 0
@@ -114,7 +149,11 @@ def exp2(traffic):
     print(pdr_results)
 
 
-def exp3(traffic, algorithm):
+# With `batches` > 0, each long run is split into that many batches run in parallel,
+# and the PDR is printed with its 95% confidence interval.
+# With `slopes`, the derivative of the PDR with respect to the varied link quality is
+# printed as well, so that a coarser grid of link qualities is enough
+def exp3(traffic, algorithm, batches = 0, slopes = False):
     oldNumSlotframes = sim.NUM_SLOTFRAMES
     sim.NUM_SLOTFRAMES = 100000
 
@@ -124,6 +163,7 @@ def exp3(traffic, algorithm):
 
     prr = [ 0.3,  0.325,  0.35,   0.375,  0.4,    0.425,  0.45,   0.475, 0.5,    0.525, 0.55,   0.575,  0.6,    0.625,  0.65, 0.675,  0.7  ]
     N = len(prr)
+    expectRuns(len(slot_list) * N * max(1, batches))
 
     pdr_results = [0.0] * len(slot_list)
     for sharedslots in range(len(slot_list)):
@@ -133,8 +173,23 @@ def exp3(traffic, algorithm):
         for i4 in range(N):
             p4 = prr[i4]
 
-            stats = simAny([traffic, traffic, traffic, traffic], [p1,p2, p3, p4], 0.7, algorithm, slot_list[sharedslots])
-            print("PDR at {} shared slots {} link quality: {}".format(slot_list[sharedslots], p4, stats.pdr))
+            if batches:
+                result = batch.simulateBatchMeans("simulateAny", [[traffic, traffic, traffic, traffic], [p1, p2, p3, p4],
+                                                                  0.7, algorithm, TOTAL_SLOTS, slot_list[sharedslots]],
+                                                  batches, progress = meter)
+                stats = result.stats
+                print("PDR at {} shared slots {} link quality: {} +- {}".format(
+                    slot_list[sharedslots], p4, stats.pdr, result.pdrHalfWidth))
+            elif slopes:
+                estimator = sensitivity.SensitivityEstimator()
+                stats = simAny([traffic, traffic, traffic, traffic], [p1,p2, p3, p4], 0.7, algorithm, slot_list[sharedslots],
+                               estimator)
+                slope, stderr = estimator.pdrGradient()[3]
+                print("PDR at {} shared slots {} link quality: {} slope {} +- {}".format(
+                    slot_list[sharedslots], p4, stats.pdr, slope, stderr))
+            else:
+                stats = simAny([traffic, traffic, traffic, traffic], [p1,p2, p3, p4], 0.7, algorithm, slot_list[sharedslots])
+                print("PDR at {} shared slots {} link quality: {}".format(slot_list[sharedslots], p4, stats.pdr))
             i += 1
             pdr_results[sharedslots] += stats.pdr
 
@@ -193,12 +248,43 @@ def exp4(traffic): # Fig. 6
     print("")
     print(pdr_results_min_i)
 
+
+# Like exp4, but selects the best number of shared slots out of all possible
+# numbers with successive halving, instead of simulating 0, 8 and 16 at full length
+def exp4Select(traffic):
+    REPEAT = 1000
+
+    best_list = [0] * REPEAT
+    pdr_list = [0] * REPEAT
+    std_list = [0] * REPEAT
+    mean_list = [0] * REPEAT
+
+    for i in range(REPEAT):
+        prrlist = [random.random()/2.0 + 0.5 for _ in range(4)]
+        mean_list[i], std_list[i] = sim.std(prrlist)
+
+        best_list[i], pdr, stderr = selection.selectSharedSlots([traffic] * 4, prrlist, 0.7,
+                                                               sim.ALGORITHM_CONTIKI, TOTAL_SLOTS)
+        pdr_list[i] = 1 - pdr/100.0
+        print(best_list[i], pdr_list[i])
+
+    print("")
+    print(mean_list)
+    print("")
+    print(std_list)
+    print("")
+    print(best_list)
+
 ################################################################################
     
 # This produces data for Figure 6 from the paper
 if 0:
     exp4(14)
 
+# The same as above, over all numbers of shared slots
+if 0:
+    exp4Select(14)
+
 # This produces data for Figure 7 from the paper
 if 0:
     exp2(9)
@@ -215,3 +301,9 @@ if 1:
 # This produces improved version of the experiment with negotiated shared schedule
 if 1:
     exp3(6, sim.ALGORITHM_CONTIKI_NEGOTIATED)
+
+if results is not None:
+    results.close()
+
+if meter is not None:
+    meter.close()